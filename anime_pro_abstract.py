@@ -8,39 +8,22 @@ Using a LLM and a text2img model.
 
 from __future__ import annotations
 
-from typing import AsyncIterable
-import asyncio
 import fastapi_poe as fp
-from modal import Image, App, asgi_app
+from modal import App, asgi_app
 import modal
-import time
-import re
 import os
 
+from botkit import deploy, metrics, warmpool
+from botkit.pipeline import Describe, Pipeline, PipelineBot, Render
+
 # Define 2 models for LLM and image model, can be changed with any POE bots
 LLM_MODEL = "Gemini-1.0-Pro"
 IMAGE_MODEL = "Playground-v3"
 
-class CartoonAvatarBot(fp.PoeBot):
-    async def get_response(
-        self, request: fp.QueryRequest
-    ) -> AsyncIterable[fp.PartialResponse]:
-        try:
-            # remove content, only use the latest 1 query.
-            request.query = [request.query[-1]]
-            # pick the one last message
-            message = request.query[-1]
-            # save original user message
-            original_content = message.content
-            # validate attachment, only allow 1 and image 
-            if len(message.attachments) != 1 or not message.attachments[0].content_type.startswith('image'):
-                yield fp.PartialResponse(text="Please send an image.")
-                return
-
-            # prompt to vision model and describe the image
-            # if any key infor missed from the converted image, this prompt can be used to optimize
-            # current GPT4 on poe doesnot support this prompt.
-            message.content = f"""Based on image, describe：
+# prompt to vision model and describe the image
+# if any key infor missed from the converted image, this prompt can be used to optimize
+# current GPT4 on poe doesnot support this prompt.
+VISION_PROMPT = """Based on image, describe：
                 1. The category of the photograph, composition, angle, the color tone, the theme, a summary of the composition, and a description of the main subject(s) or object(s), including information such as age.
                 2. generate a prompt of 60 English words or less for image remix, keep main information and subjects.
                 3. Print the prompt in below json format, in english:
@@ -48,45 +31,36 @@ class CartoonAvatarBot(fp.PoeBot):
                 \`\`\`json
                 "image_prompt": ""
                 \`\`\`"""
-            # the prompt for remix image
-            final_vision_prompt = await fp.get_final_response(request, bot_name=LLM_MODEL, api_key=request.access_key)
-            print(final_vision_prompt)
-            image_prompt = self.extract_image_prompt(final_vision_prompt)
-            print(image_prompt)
-
-            # Query Image Model for creating image
-            # the attachment is kept within the same request, only prompt is placed in the content
-            # use poe remix image model, currently only SDXL and Playground is supported. Let's see when DALLE3 gives the same capability
-            message.content = f"in Abstract Harmonics style, expressive, Watercolor style of [{image_prompt}]"
-            image_response = await fp.get_final_response(request, bot_name=IMAGE_MODEL, api_key=request.access_key)
-            print(image_response)
-            yield fp.PartialResponse(text=f'{image_response}')
-        except:
-            yield fp.PartialResponse(text="Something went wrong. Please try again or contact the admin.")
-            return
+
+
+def compose_image_prompt(ctx, fields):
+    # Query Image Model for creating image
+    # the attachment is kept within the same request, only prompt is placed in the content
+    # use poe remix image model, currently only SDXL and Playground is supported. Let's see when DALLE3 gives the same capability
+    image_prompt = fields["image_prompt"]
+    return f"in Abstract Harmonics style, expressive, Watercolor style of [{image_prompt}]"
+
+
+class CartoonAvatarBot(PipelineBot):
+    pipeline = Pipeline(
+        "anime-pro-abstract",
+        require_image=True,
+        describe=Describe(LLM_MODEL, VISION_PROMPT),
+        compose=compose_image_prompt,
+        render=Render(IMAGE_MODEL, keep_attachment=True),
+    )
+
     async def get_settings(self, setting: fp.SettingsRequest) -> fp.SettingsResponse:
         return fp.SettingsResponse(server_bot_dependencies={LLM_MODEL: 1, IMAGE_MODEL: 1}, 
                                    introduction_message="Welcome to the Anime Image Bot running by @xiaowenzhang. Please provide a image I will create a cartoon style avatar image for you...",
                                    allow_attachments=True)
-    
-    # Read the JSON string and extract the image_prompt and caption. Poe does not support JSON object call on GPT3.5/4
-    def extract_image_prompt(self, long_string):
-    # 定义正则表达式模式
-        pattern = r'"image_prompt": "(.*?)"'
-        
-        # 使用re.search查找第一个匹配项
-        match = re.search(pattern, long_string)
-        
-        # 如果找到匹配项，返回匹配的内容，否则返回"ERROR"
-        return match.group(1) if match else "ERROR"
-
-
-REQUIREMENTS = ["fastapi-poe==0.0.44"] # latest 0.0.34
-image = Image.debian_slim().pip_install(*REQUIREMENTS)
+
+
+image = deploy.base_image()
 app = App("anime-pro-abstract-poe")
 
 
-@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()])
+@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()], **deploy.container_options())
 @asgi_app()
 def fastapi_app():
     bot = CartoonAvatarBot()
@@ -101,4 +75,13 @@ def fastapi_app():
 
     #app = fp.make_app(bot, allow_without_key=True)
     app = fp.make_app(bot, access_key=os.environ["ANIME_PRO_ABS_BOT_KEY"])
+    metrics.install(app)
+    warmpool.install(app)
     return app
+
+
+# low, bursty traffic: keep containers warm on the WARM_SCHEDULE, see botkit.warmpool
+@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()],
+              schedule=modal.Period(minutes=warmpool.WARM_PING_MINUTES))
+def keep_warm():
+    warmpool.tick(fastapi_app)
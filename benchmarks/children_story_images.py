@@ -0,0 +1,127 @@
+"""
+
+Latency benchmark for the ChildrenStoryCreatorBot illustration stage.
+
+Replaces the LLM and image bots with local stubs: the story is streamed over
+--llm-latency seconds and every image takes --image-latency seconds. Compares
+time to the first section and end-to-end wall clock with IMAGE_CONCURRENCY=1
+(the old one-image-after-another behaviour) against the configured concurrency.
+
+    python benchmarks/children_story_images.py --image-latency 3 --runs 3
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import fastapi_poe as fp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bots import botkit from the repo root
+sys.path.insert(0, ROOT)
+
+from botkit import tracing  # noqa: E402
+
+STORY_JSON = json.dumps(
+    [
+        {"story_text": f"Section {i} text.", "image_prompt": f"A bunny, scene {i}"}
+        for i in range(1, 5)
+    ]
+)
+
+
+def load_bot_module():
+    path = os.path.join(ROOT, "deploy2", "children_story_creator.py")
+    spec = importlib.util.spec_from_file_location("children_story_creator", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def install_stubs(llm_model, llm_latency, image_latency):
+    # the story is streamed in small chunks spread over llm_latency seconds
+    story = f"```json\n{STORY_JSON}\n```"
+    chunk_size = 16
+
+    async def fake_stream_request(request, bot_name, api_key="", **kwargs):
+        if bot_name == llm_model:
+            chunks = [
+                story[i : i + chunk_size] for i in range(0, len(story), chunk_size)
+            ]
+            for chunk in chunks:
+                await asyncio.sleep(llm_latency / len(chunks))
+                yield fp.PartialResponse(text=chunk)
+            return
+        await asyncio.sleep(image_latency)
+        yield fp.PartialResponse(
+            text="",
+            attachment=fp.Attachment(
+                url="https://example.invalid/image.png",
+                content_type="image/png",
+                name="image.png",
+            ),
+        )
+
+    fp.stream_request = fake_stream_request
+
+
+def make_request():
+    return fp.QueryRequest(
+        version="1.0",
+        type="query",
+        query=[fp.ProtocolMessage(role="user", content="A story about a brave bunny")],
+        user_id="bench-user",
+        conversation_id="bench-conversation",
+        message_id="bench-message",
+        access_key="",
+    )
+
+
+async def run_once(bot):
+    started = time.perf_counter()
+    first_section = None
+    async for response in bot.get_response(make_request()):
+        if first_section is None and "Section 1" in response.text:
+            first_section = time.perf_counter() - started
+    return first_section, time.perf_counter() - started
+
+
+async def main(args):
+    # keep the trace records out of the report
+    tracing.exporter.output = open(os.devnull, "w")
+    module = load_bot_module()
+    install_stubs(module.LLM_MODEL, args.llm_latency, args.image_latency)
+    bot = module.ChildrenStoryCreatorBot()
+
+    results = {}
+    render = bot.pipeline.render
+    for concurrency in (1, module.IMAGE_CONCURRENCY):
+        render.concurrency = concurrency
+        totals = []
+        for _ in range(args.runs):
+            first_section, total = await run_once(bot)
+            totals.append(total)
+        results[concurrency] = sum(totals) / len(totals)
+        print(
+            f"concurrency={concurrency}: first section {first_section:.2f}s, "
+            f"total {results[concurrency]:.2f}s (mean of {args.runs})"
+        )
+
+    sequential, concurrent = results[1], results[max(results)]
+    saved = sequential - concurrent
+    print(f"wall-clock reduction: {saved:.2f}s ({sequential / concurrent:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--image-latency", type=float, default=2.0)
+    parser.add_argument("--runs", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
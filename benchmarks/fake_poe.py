@@ -0,0 +1,307 @@
+"""
+
+Local stand-in for the Poe bot API, for offline latency and load runs.
+
+Speaks the server-bot protocol used by fp.stream_request / fp.get_final_response:
+POST /bot/<bot_name> answers with server-sent events (meta, text, file, error,
+done). Each downstream model gets a ModelProfile with a latency distribution,
+a token streaming rate, an error rate and optional image attachments. LLM
+replies fill in whatever "key": "" fields the prompt's json template asks for,
+so every bot's parser sees the shape it expects.
+
+    with FakePoeServer() as server, route_to(server.base_url):
+        ...  # fp.stream_request now talks to the local server
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import math
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import fastapi_poe as fp
+import fastapi_poe.client
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+def make_png(width: int, height: int) -> bytes:
+    """A solid colour RGB PNG of the given size"""
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(body))
+            + kind
+            + body
+            + struct.pack(">I", zlib.crc32(kind + body) & 0xFFFFFFFF)
+        )
+
+    row = b"\x00" + b"\xf0\x90\x40" * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+@dataclass
+class ModelProfile:
+    # time to the first event, drawn from a log-normal fitted to p50/p99 (seconds)
+    latency_p50: float = 1.0
+    latency_p99: float = 3.0
+    # streaming rate of the text after the first event
+    tokens_per_second: float = 50.0
+    # number of image attachments sent with the reply
+    attachments: int = 0
+    # probability that the request fails with an error event
+    error_rate: float = 0.0
+    # fixed reply text; None means "fill in the json fields the prompt asks for"
+    text: Optional[str] = None
+
+    def sample_latency(self) -> float:
+        if self.latency_p99 <= self.latency_p50:
+            return self.latency_p50
+        # p99 of a log-normal is exp(mu + 2.326 sigma)
+        sigma = math.log(self.latency_p99 / self.latency_p50) / 2.326
+        return random.lognormvariate(math.log(self.latency_p50), sigma)
+
+
+def llm(
+    p50: float = 2.0, p99: float = 6.0, tokens_per_second: float = 60.0
+) -> ModelProfile:
+    return ModelProfile(
+        latency_p50=p50, latency_p99=p99, tokens_per_second=tokens_per_second
+    )
+
+
+def image_model(p50: float = 8.0, p99: float = 20.0) -> ModelProfile:
+    return ModelProfile(
+        latency_p50=p50, latency_p99=p99, tokens_per_second=1000.0, attachments=1
+    )
+
+
+# rough numbers for the downstream bots used in this repo
+DEFAULT_PROFILES = {
+    "Claude-3-Haiku": llm(0.8, 2.5, 120),
+    "Claude-3.5-Haiku": llm(0.8, 2.5, 120),
+    "Claude-3-Sonnet": llm(1.5, 5.0, 60),
+    "GPT-4o": llm(1.0, 4.0, 80),
+    "Gemini-1.0-Pro": llm(1.0, 3.0, 80),
+    "Gemini-1.5-Pro": llm(1.5, 5.0, 60),
+    "Gemini-2.5-Flash-Preview": llm(1.0, 3.0, 150),
+    "Gemini-2.5-Pro-Preview": llm(4.0, 15.0, 60),
+    "RekaFlash": llm(1.0, 3.0, 80),
+    "ComicBookStyle-PGV2": image_model(6.0, 15.0),
+    "FLUX-pro-1.1": image_model(8.0, 25.0),
+    "Ideogram": image_model(8.0, 20.0),
+    "Ideogram-v2": image_model(8.0, 20.0),
+    "Ideogram-v3": image_model(10.0, 30.0),
+    "Imagen-3-Fast": image_model(4.0, 10.0),
+    "Playground-v2.5": image_model(5.0, 12.0),
+    "Playground-v3": image_model(5.0, 12.0),
+    "StableDiffusion3": image_model(6.0, 15.0),
+}
+
+_TEMPLATE_KEY = re.compile(r'"(\w+)"\s*:')
+_FILLER = "a small orange cat in a sunny kitchen, soft light, playful mood"
+
+
+def fill_template(prompt: str) -> str:
+    """Answer a bot prompt with every field of its json template filled in"""
+    keys = list(dict.fromkeys(_TEMPLATE_KEY.findall(prompt)))
+    if "story_text" in keys:
+        body = json.dumps(
+            [
+                {
+                    "story_text": f"Part {i} of the story. {_FILLER}.",
+                    "image_prompt": _FILLER,
+                }
+                for i in range(1, 5)
+            ],
+            ensure_ascii=False,
+            indent=2,
+        )
+    elif keys:
+        body = ",\n".join(f'"{key}": "{_FILLER}"' for key in keys)
+    else:
+        body = f'"text": "{_FILLER}"'
+    return f"Here is the result.\n```json\n{body}\n```"
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class FakePoeServer:
+    """Runs the stand-in server on a background thread with its own event loop"""
+
+    def __init__(
+        self,
+        profiles: Optional[dict[str, ModelProfile]] = None,
+        latency_scale: float = 1.0,
+        default_profile: Optional[ModelProfile] = None,
+        photo_size: tuple[int, int] = (640, 480),
+        host: str = "127.0.0.1",
+    ):
+        self.profiles = dict(DEFAULT_PROFILES if profiles is None else profiles)
+        # served for every uploaded or generated image URL
+        self.png_bytes = make_png(*photo_size)
+        self.latency_scale = latency_scale
+        self.default_profile = default_profile or llm()
+        self.host = host
+        self.port = _free_port(host)
+        self.requests: dict[str, int] = {}
+        # files sent to fp.upload_file, by name
+        self.uploads: dict[str, bytes] = {}
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self.app = Starlette(
+            routes=[
+                Route("/bot/{bot_name}", self._handle_bot, methods=["POST"]),
+                Route("/files/{name}", self._handle_file, methods=["GET"]),
+                Route(
+                    "/file_upload_3RD_PARTY_POST", self._handle_upload, methods=["POST"]
+                ),
+            ]
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot/"
+
+    def file_url(self, name: str = "photo.png") -> str:
+        return f"http://{self.host}:{self.port}/files/{name}"
+
+    def profile(self, bot_name: str) -> ModelProfile:
+        return self.profiles.get(bot_name, self.default_profile)
+
+    async def _handle_file(self, request: Request) -> Response:
+        name = request.path_params["name"]
+        if name in self.uploads:
+            return Response(self.uploads[name], media_type="image/jpeg")
+        return Response(self.png_bytes, media_type="image/png")
+
+    async def _handle_upload(self, request: Request) -> Response:
+        # one multipart part, read by hand: starlette's form parser needs
+        # python-multipart
+        boundary = request.headers["content-type"].split("boundary=", 1)[1].encode()
+        part = (await request.body()).split(b"--" + boundary)[1]
+        headers, body = part.split(b"\r\n\r\n", 1)
+        name = re.search(rb'filename="([^"]+)"', headers).group(1).decode()
+        self.uploads[name] = body[: -len(b"\r\n")]
+        return JSONResponse(
+            {"attachment_url": self.file_url(name), "mime_type": "image/jpeg"}
+        )
+
+    async def _handle_bot(self, request: Request) -> Response:
+        bot_name = request.path_params["bot_name"]
+        payload = await request.json()
+        if payload.get("type") != "query":
+            # report_error / report_feedback / settings
+            return JSONResponse({})
+        self.requests[bot_name] = self.requests.get(bot_name, 0) + 1
+        profile = self.profile(bot_name)
+        prompt = payload["query"][-1]["content"] if payload.get("query") else ""
+        return StreamingResponse(
+            self._events(profile, prompt), media_type="text/event-stream"
+        )
+
+    async def _events(self, profile: ModelProfile, prompt: str):
+        yield _sse("meta", {"content_type": "text/markdown", "linkify": True})
+        await asyncio.sleep(profile.sample_latency() * self.latency_scale)
+        if random.random() < profile.error_rate:
+            yield _sse("error", {"text": "Fake upstream error", "allow_retry": False})
+            return
+
+        if profile.attachments:
+            for i in range(profile.attachments):
+                url = self.file_url(f"generated-{i}.png")
+                yield _sse(
+                    "file",
+                    {
+                        "url": url,
+                        "content_type": "image/png",
+                        "name": f"generated-{i}.png",
+                    },
+                )
+                yield _sse("text", {"text": f"![image]({url})\n\n"})
+        else:
+            text = profile.text if profile.text is not None else fill_template(prompt)
+            # about four characters per token, sent in ~20ms batches
+            chars_per_batch = max(1, int(profile.tokens_per_second * 4 * 0.02))
+            for i in range(0, len(text), chars_per_batch):
+                yield _sse("text", {"text": text[i : i + chars_per_batch]})
+                await asyncio.sleep(0.02 * self.latency_scale)
+        yield _sse("done", {})
+
+    def __enter__(self) -> FakePoeServer:
+        config = uvicorn.Config(
+            self.app,
+            host=self.host,
+            port=self.port,
+            log_level="warning",
+            lifespan="off",
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("fake Poe server did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def route_to(base_url: str):
+    """Send every fp.stream_request, fp.get_final_response and fp.upload_file call
+    to `base_url`"""
+    original = fastapi_poe.client.stream_request
+    original_upload = fp.upload_file
+    # uploads go to the server root, not under /bot/
+    upload_base_url = base_url.rstrip("/").rsplit("/", 1)[0] + "/"
+
+    def stream_request(*args, **kwargs):
+        kwargs["base_url"] = base_url
+        return original(*args, **kwargs)
+
+    def upload_file(*args, **kwargs):
+        kwargs["base_url"] = upload_base_url
+        return original_upload(*args, **kwargs)
+
+    # get_final_response calls the module level stream_request in fastapi_poe.client
+    fastapi_poe.client.stream_request = stream_request
+    fp.stream_request = stream_request
+    fp.upload_file = upload_file
+    try:
+        yield
+    finally:
+        fastapi_poe.client.stream_request = original
+        fp.stream_request = original
+        fp.upload_file = original_upload
@@ -0,0 +1,195 @@
+"""
+
+Drive bots' get_response against the local fake Poe server.
+
+Runs every bot (or the ones given with --bot) in-process, sends --requests
+queries with --concurrency users in flight, and reports p50/p99 latency and
+throughput. Downstream calls go over HTTP to benchmarks/fake_poe.py, so no
+network or Poe account is needed.
+The image and vision description caches are off, so every request pays
+for its model calls.
+
+    python benchmarks/harness.py --bot pixar-plus --requests 40 --concurrency 8 \
+        --latency-scale 0.1
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import os
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+import fastapi_poe as fp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bots import botkit from the repo root
+sys.path.insert(0, ROOT)
+
+from fake_poe import FakePoeServer, route_to  # noqa: E402
+
+import host  # noqa: E402
+from botkit import image_cache, tracing, vision  # noqa: E402
+from botkit.cache import LayeredCache, TTLCache  # noqa: E402
+
+# (name, bot file, bot class): the hosted bots plus the two at the repo root
+BOTS = [
+    (path.strip("/"), bot_file, class_name)
+    for path, bot_file, class_name, _ in host.BOTS
+] + [
+    ("anime-pro-abstract", "anime_pro_abstract.py", "CartoonAvatarBot"),
+    ("story-teller", "story_teller.py", "CartoonAvatarBot"),
+]
+
+
+@dataclass
+class RequestResult:
+    started: float
+    # time of the first PartialResponse, relative to `started`
+    first_response: Optional[float] = None
+    # time of the first response carrying an image, relative to `started`
+    first_image: Optional[float] = None
+    total: Optional[float] = None
+    error: Optional[str] = None
+
+
+_topics = itertools.count(1)
+
+
+def disable_caches() -> None:
+    """Measure the model calls, not cache hits of repeated benchmark requests"""
+    image_cache.IMAGE_CACHE_MODE = "off"
+    # keeps nothing: every photo is described by the vision model
+    vision.description_cache = LayeredCache(TTLCache(max_entries=0))
+
+
+def make_request(
+    server: FakePoeServer, content: Optional[str] = None
+) -> fp.QueryRequest:
+    # a topic of its own by default: the same text from concurrent users would
+    # share one LLM call in the bots with Extract(coalesce=True)
+    content = content or f"monday {next(_topics)}"
+    # every bot gets a photo attachment: the photo bots need one, the others ignore it
+    attachment = fp.Attachment(
+        url=server.file_url("photo.png"), content_type="image/png", name="photo.png"
+    )
+    return fp.QueryRequest(
+        version="1.0",
+        type="query",
+        query=[
+            fp.ProtocolMessage(role="user", content=content, attachments=[attachment])
+        ],
+        user_id=f"u-{uuid.uuid4().hex[:8]}",
+        conversation_id=f"c-{uuid.uuid4().hex[:8]}",
+        message_id=f"m-{uuid.uuid4().hex[:8]}",
+        # sent as the bearer token downstream, the fake server does not check it
+        access_key="fake-access-key",
+    )
+
+
+async def run_request(bot: fp.PoeBot, request: fp.QueryRequest) -> RequestResult:
+    result = RequestResult(started=time.perf_counter())
+    try:
+        async for response in bot.get_response(request):
+            elapsed = time.perf_counter() - result.started
+            if result.first_response is None:
+                result.first_response = elapsed
+            if result.first_image is None and "![" in response.text:
+                result.first_image = elapsed
+            if (
+                "Something went wrong" in response.text
+                or "Sorry" in response.text
+                or "busy right now" in response.text
+            ):
+                result.error = response.text
+    except Exception as e:
+        result.error = repr(e)
+    result.total = time.perf_counter() - result.started
+    return result
+
+
+async def drive(
+    bot: fp.PoeBot, server: FakePoeServer, requests: int, concurrency: int
+) -> tuple[list[RequestResult], float]:
+    """Send `requests` queries with at most `concurrency` in flight; results and
+    wall time"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> RequestResult:
+        async with semaphore:
+            return await run_request(bot, make_request(server))
+
+    started = time.perf_counter()
+    # keep any stray bot output out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = await asyncio.gather(*(one() for _ in range(requests)))
+    return list(results), time.perf_counter() - started
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(name: str, results: list[RequestResult], wall: float) -> dict:
+    totals = [r.total for r in results if r.error is None]
+    return {
+        "bot": name,
+        "requests": len(results),
+        "errors": sum(r.error is not None for r in results),
+        "p50": percentile(totals, 50),
+        "p99": percentile(totals, 99),
+        "throughput": len(results) / wall,
+    }
+
+
+def load_bot(bot_file: str, class_name: str) -> fp.PoeBot:
+    return host.load_bot_class(bot_file, class_name)()
+
+
+async def main(args) -> None:
+    # traces are still serialized and written, just not shown
+    tracing.exporter.output = open(os.devnull, "w")
+    disable_caches()
+    selected = [bot for bot in BOTS if not args.bot or bot[0] in args.bot]
+    with FakePoeServer(latency_scale=args.latency_scale) as server, route_to(
+        server.base_url
+    ):
+        print(
+            f"{'bot':<26} {'req':>5} {'err':>4} {'p50 s':>8} {'p99 s':>8} {'req/s':>8}"
+        )
+        for name, bot_file, class_name in selected:
+            bot = load_bot(bot_file, class_name)
+            results, wall = await drive(bot, server, args.requests, args.concurrency)
+            row = summarize(name, results, wall)
+            print(
+                f"{row['bot']:<26} {row['requests']:>5} {row['errors']:>4} "
+                f"{row['p50']:>8.2f} {row['p99']:>8.2f} {row['throughput']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bot", action="append", help="bot name (repeatable), default: all"
+    )
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="multiply every fake latency by this",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,178 @@
+"""
+
+Startup benchmark: import time and time to first response per bot.
+
+Every bot is started in a fresh Python process, as in a cold container, which
+reports:
+
+- import_s: loading the bot file (fastapi_poe, modal, botkit and the bot)
+- build_s: constructing the bot and its FastAPI app
+- settings_s: answering the first settings request through the app
+- first_response_s: the first PartialResponse of the first query, with
+  downstream calls going to the fake Poe server
+- process_s: process spawn to the first response, interpreter start included
+
+    python benchmarks/startup.py --latency-scale 0.1
+    python benchmarks/startup.py --bot pixar-plus --runs 5 --output startup.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# the bot app checks it on every request, Poe keys are 32 characters
+ACCESS_KEY = "startup-benchmark-key-0000000000"
+KEYS = ("import_s", "build_s", "settings_s", "first_response_s", "process_s")
+
+
+def child(bot_file: str, class_name: str, base_url: str, file_url: str) -> None:
+    """Runs in the fresh process: time each startup phase and print them as JSON"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, HERE)
+    import host
+
+    bot_class = host.load_bot_class(bot_file, class_name)
+    imported = time.perf_counter()
+
+    import fastapi_poe as fp
+
+    from botkit import metrics
+
+    bot = bot_class()
+    app = fp.make_app(bot, access_key=ACCESS_KEY)
+    metrics.install(app)
+    built = time.perf_counter()
+
+    import asyncio
+    import types
+
+    import httpx
+    from fake_poe import route_to
+    from harness import disable_caches, make_request, run_request
+
+    from botkit import tracing
+
+    tracing.exporter.output = open(os.devnull, "w")
+    disable_caches()
+
+    async def first_calls() -> tuple[float, float]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bot"
+        ) as client:
+            settings_started = time.perf_counter()
+            response = await client.post(
+                "/",
+                json={"version": "1.0", "type": "settings"},
+                headers={"Authorization": f"Bearer {ACCESS_KEY}"},
+            )
+            response.raise_for_status()
+            settings = time.perf_counter() - settings_started
+        server = types.SimpleNamespace(file_url=lambda name="photo.png": file_url)
+        with route_to(base_url):
+            result = await run_request(bot, make_request(server))
+        if result.error is not None:
+            raise RuntimeError(result.error)
+        return settings, result.first_response
+
+    settings, first_response = asyncio.run(first_calls())
+    print(
+        json.dumps(
+            {
+                "import_s": round(imported - started, 4),
+                "build_s": round(built - imported, 4),
+                "settings_s": round(settings, 4),
+                "first_response_s": round(first_response, 4),
+            }
+        )
+    )
+
+
+def run_bot(bot_file: str, class_name: str, server) -> dict:
+    spawned = time.perf_counter()
+    output = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--child",
+            bot_file,
+            class_name,
+            server.base_url,
+            server.file_url(),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    # the child exits right after printing, so this is close to spawn-to-first-response
+    result["process_s"] = round(time.perf_counter() - spawned, 4)
+    return result
+
+
+def main(args) -> None:
+    sys.path.insert(0, ROOT)
+    from fake_poe import FakePoeServer
+    from harness import BOTS
+
+    selected = [bot for bot in BOTS if not args.bot or bot[0] in args.bot]
+    report = {
+        "settings": {"runs": args.runs, "latency_scale": args.latency_scale},
+        "bots": [],
+    }
+    print(f"{'bot':<26} " + " ".join(f"{key:>16}" for key in KEYS), file=sys.stderr)
+    with FakePoeServer(latency_scale=args.latency_scale) as server:
+        for name, bot_file, class_name in selected:
+            runs = [run_bot(bot_file, class_name, server) for _ in range(args.runs)]
+            medians = {
+                key: round(statistics.median(run[key] for run in runs), 4)
+                for key in KEYS
+            }
+            report["bots"].append({"bot": name, **medians, "runs": runs})
+            print(
+                f"{name:<26} " + " ".join(f"{medians[key]:>16.3f}" for key in KEYS),
+                file=sys.stderr,
+            )
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(*sys.argv[2:6])
+        sys.exit(0)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bot", action="append", help="bot name (repeatable), default: all"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="fresh processes per bot, the median is reported",
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=0.1,
+        help="multiply every fake latency by this",
+    )
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    main(parser.parse_args())
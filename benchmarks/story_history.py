@@ -0,0 +1,150 @@
+"""
+
+Per-turn prompt size and latency of story_teller.py over a long conversation.
+
+Replaces the models with local stubs whose time to the first token grows with
+the prompt (--ms-per-kchar on top of --llm-latency), then plays a --turns turn
+story, the bot's answers fed back as history, once replaying the whole
+conversation (history=True) and once with the bot's CompactHistory. Prints the
+prompt size and the time to the story text of every --every turns.
+
+    python benchmarks/story_history.py --turns 40 --every 5
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import fastapi_poe as fp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bots import botkit from the repo root
+sys.path.insert(0, ROOT)
+
+from botkit import history, image_cache, tracing  # noqa: E402
+
+STORY = "The brave bunny met a new friend by the river and they talked until dark. " * 4
+
+
+def load_bot_module():
+    path = os.path.join(ROOT, "story_teller.py")
+    spec = importlib.util.spec_from_file_location("story_teller", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def install_stubs(module, llm_latency, ms_per_kchar, prompt_sizes):
+    fields = {"short_image_prompt": "A bunny by the river", "story": STORY}
+    reply = f"```json\n{json.dumps(fields)}\n```"
+
+    async def fake_stream_request(request, bot_name, api_key="", **kwargs):
+        chars = sum(len(m.content) for m in request.query)
+        if bot_name == module.LLM_MODEL:
+            prompt_sizes.append(chars)
+        if bot_name == module.IMAGE_MODEL:
+            await asyncio.sleep(llm_latency)
+            yield fp.PartialResponse(
+                text="",
+                attachment=fp.Attachment(
+                    url="https://example.invalid/image.png",
+                    content_type="image/png",
+                    name="image.png",
+                ),
+            )
+            return
+        await asyncio.sleep(llm_latency + ms_per_kchar * chars / 1000 / 1000)
+        if bot_name == module.SUMMARY_MODEL:
+            yield fp.PartialResponse(text=STORY)
+            return
+        yield fp.PartialResponse(text=reply)
+
+    fp.stream_request = fake_stream_request
+
+
+def make_request(query):
+    return fp.QueryRequest(
+        version="1.0",
+        type="query",
+        query=query,
+        user_id="bench-user",
+        conversation_id="bench-conversation",
+        message_id="bench-message",
+        access_key="",
+    )
+
+
+async def play(bot, turns, think):
+    """(prompt chars, seconds to the story text) per turn"""
+    query = []
+    rows = []
+    for _ in range(turns):
+        query.append(fp.ProtocolMessage(role="user", content="What happens next?"))
+        started = time.perf_counter()
+        first_text = None
+        answer = []
+        async for response in bot.get_response(make_request(list(query))):
+            if first_text is None:
+                first_text = time.perf_counter() - started
+            answer.append(response.text)
+        query.append(fp.ProtocolMessage(role="bot", content="".join(answer)))
+        rows.append(first_text)
+        # the user reads the page; background summary updates finish here
+        await asyncio.sleep(think)
+    return rows
+
+
+async def main(args):
+    # keep the trace records out of the report
+    tracing.exporter.output = open(os.devnull, "w")
+    image_cache.IMAGE_CACHE_MODE = "off"
+    module = load_bot_module()
+    bot = module.CartoonAvatarBot()
+    extract = bot.pipeline.extract
+    compact = extract.history
+
+    results = {}
+    for name, setting in (("full", True), ("compact", compact)):
+        extract.history = setting
+        history.summary_cache.memory._entries.clear()
+        sizes: list[int] = []
+        install_stubs(module, args.llm_latency, args.ms_per_kchar, sizes)
+        results[name] = (sizes, await play(bot, args.turns, args.think))
+
+    print(
+        f"{'turn':>5} {'full chars':>11} {'full s':>8} "
+        f"{'compact chars':>14} {'compact s':>10}"
+    )
+    for turn in range(0, args.turns, args.every):
+        full_sizes, full_times = results["full"]
+        compact_sizes, compact_times = results["compact"]
+        print(
+            f"{turn + 1:>5} {full_sizes[turn]:>11} {full_times[turn]:>8.2f} "
+            f"{compact_sizes[turn]:>14} {compact_times[turn]:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--every", type=int, default=5, help="print every n-th turn")
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.05, help="seconds before the first token"
+    )
+    parser.add_argument(
+        "--ms-per-kchar",
+        type=float,
+        default=20.0,
+        help="extra first-token latency per 1000 prompt chars",
+    )
+    parser.add_argument(
+        "--think", type=float, default=0.2, help="seconds between turns"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,138 @@
+"""
+
+Latency benchmark for the speculative image render of story_teller.py.
+
+Replaces the LLM and image bots with local stubs: the reply puts
+short_image_prompt first and then streams the story over --llm-latency
+seconds, and the image takes --image-latency seconds. Compares the time to the
+image with Extract.prefetch off (the image call starts after the whole story)
+against on (it starts once short_image_prompt is in). --malformed drops the
+story from the reply, so the speculative image must be cancelled.
+
+    python benchmarks/story_prefetch.py --llm-latency 3 --image-latency 5 --runs 3
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import fastapi_poe as fp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bots import botkit from the repo root
+sys.path.insert(0, ROOT)
+
+from botkit import metrics, tracing  # noqa: E402
+
+IMAGE_PROMPT = "A bunny reading under a mushroom, comic book style"
+STORY = "The brave bunny walked into the dark forest. " * 12
+
+
+def load_bot_module():
+    path = os.path.join(ROOT, "story_teller.py")
+    spec = importlib.util.spec_from_file_location("story_teller", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def install_stubs(llm_model, llm_latency, image_latency, malformed):
+    fields = {"short_image_prompt": IMAGE_PROMPT}
+    if not malformed:
+        fields["story"] = STORY
+    reply = f"```json\n{json.dumps(fields, ensure_ascii=False)}\n```"
+    if malformed:
+        # the story never comes; the reply trails off instead
+        reply += "\nSorry, I lost the thread of the story." * 8
+    chunk_size = 16
+
+    async def fake_stream_request(request, bot_name, api_key="", **kwargs):
+        if bot_name == llm_model:
+            chunks = [
+                reply[i : i + chunk_size] for i in range(0, len(reply), chunk_size)
+            ]
+            for chunk in chunks:
+                await asyncio.sleep(llm_latency / len(chunks))
+                yield fp.PartialResponse(text=chunk)
+            return
+        await asyncio.sleep(image_latency)
+        yield fp.PartialResponse(
+            text="",
+            attachment=fp.Attachment(
+                url="https://example.invalid/image.png",
+                content_type="image/png",
+                name="image.png",
+            ),
+        )
+
+    fp.stream_request = fake_stream_request
+
+
+def make_request():
+    return fp.QueryRequest(
+        version="1.0",
+        type="query",
+        query=[fp.ProtocolMessage(role="user", content="A story about a brave bunny")],
+        user_id="bench-user",
+        conversation_id="bench-conversation",
+        message_id="bench-message",
+        access_key="",
+    )
+
+
+async def run_once(bot):
+    started = time.perf_counter()
+    first_image = None
+    async for response in bot.get_response(make_request()):
+        if first_image is None and "![" in response.text:
+            first_image = time.perf_counter() - started
+    return first_image, time.perf_counter() - started
+
+
+async def main(args):
+    # keep the trace records out of the report
+    tracing.exporter.output = open(os.devnull, "w")
+    module = load_bot_module()
+    install_stubs(
+        module.LLM_MODEL, args.llm_latency, args.image_latency, args.malformed
+    )
+    bot = module.CartoonAvatarBot()
+
+    results = {}
+    extract = bot.pipeline.extract
+    prefetch_field = extract.prefetch
+    for prefetch in (None, prefetch_field):
+        extract.prefetch = prefetch
+        totals = []
+        for _ in range(args.runs):
+            first_image, total = await run_once(bot)
+            totals.append(total)
+        results[prefetch] = sum(totals) / len(totals)
+        image = f"{first_image:.2f}s" if first_image is not None else "none"
+        print(
+            f"prefetch={prefetch}: first image {image}, "
+            f"total {results[prefetch]:.2f}s (mean of {args.runs})"
+        )
+
+    saved = results[None] - results[prefetch_field]
+    print(f"wall-clock reduction: {saved:.2f}s")
+    outcomes = {key[1]: value for key, value in metrics.prefetch.values.items()}
+    print(f"prefetch outcomes: {outcomes}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-latency", type=float, default=2.0)
+    parser.add_argument("--image-latency", type=float, default=3.0)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--malformed", action="store_true", help="leave the story out of the LLM reply"
+    )
+    asyncio.run(main(parser.parse_args()))
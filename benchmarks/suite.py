@@ -0,0 +1,308 @@
+"""
+
+Benchmark suite: per-bot latency, throughput and event-loop lag.
+
+For every bot (or --bot) against the fake Poe server:
+
+- closed loop, for each --users level: time to first PartialResponse, time to
+  first image, total latency (p50/p99), throughput and errors
+- open loop, doubling the offered rate from --start-rate: the highest
+  requests/sec the bot sustains with p99 within --slo-factor of the
+  single-user p99 and under 1% errors
+- event-loop lag (p99/max) while each run is in flight, to catch blocking
+  work inside get_response
+
+Results are written as JSON with stable keys (--output) so runs from two
+commits can be diffed, or compared directly with --baseline.
+
+    python benchmarks/suite.py --latency-scale 0.1 --output bench.json
+    python benchmarks/suite.py --latency-scale 0.1 --baseline bench.json
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Optional
+
+from fake_poe import FakePoeServer, route_to
+from harness import (
+    BOTS,
+    ROOT,
+    RequestResult,
+    disable_caches,
+    drive,
+    load_bot,
+    make_request,
+    percentile,
+    run_request,
+)
+
+from botkit import tracing
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic timer fires, i.e. how long the loop was blocked"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - expected))
+
+    async def __aenter__(self) -> LoopLagMonitor:
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+
+    def summary(self) -> dict:
+        return {
+            "loop_lag_p99_ms": (
+                round(percentile(self.samples, 99) * 1000, 2) if self.samples else 0.0
+            ),
+            "loop_lag_max_ms": round(max(self.samples, default=0.0) * 1000, 2),
+        }
+
+
+def _stat(values: list[Optional[float]], q: float) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return round(percentile(values, q), 4) if values else None
+
+
+def latency_stats(results: list[RequestResult], wall: float) -> dict:
+    ok = [r for r in results if r.error is None]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "first_response_p50": _stat([r.first_response for r in ok], 50),
+        "first_response_p99": _stat([r.first_response for r in ok], 99),
+        "first_image_p50": _stat([r.first_image for r in ok], 50),
+        "first_image_p99": _stat([r.first_image for r in ok], 99),
+        "total_p50": _stat([r.total for r in ok], 50),
+        "total_p99": _stat([r.total for r in ok], 99),
+        "throughput_rps": round(len(results) / wall, 3),
+    }
+
+
+async def closed_loop(bot, server, users: int, requests: int) -> dict:
+    async with LoopLagMonitor() as lag:
+        results, wall = await drive(bot, server, requests, users)
+    return {"users": users, **latency_stats(results, wall), **lag.summary()}
+
+
+async def open_loop(
+    bot, server, rate: float, duration: float
+) -> tuple[list[RequestResult], float]:
+    """Start requests at a fixed rate regardless of completions, like real traffic"""
+    tasks = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(max(1, int(rate * duration))):
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(run_request(bot, make_request(server))))
+        results = await asyncio.gather(*tasks)
+    return list(results), time.perf_counter() - started
+
+
+async def max_sustained_rate(bot, server, args, baseline_p99: Optional[float]) -> dict:
+    best = None
+    steps = []
+    rate = args.start_rate
+    while rate <= args.max_rate:
+        async with LoopLagMonitor() as lag:
+            results, wall = await open_loop(bot, server, rate, args.duration)
+        stats = latency_stats(results, wall)
+        error_rate = stats["errors"] / stats["requests"]
+        sustained = (
+            error_rate <= 0.01
+            and stats["total_p99"] is not None
+            and (
+                baseline_p99 is None
+                or stats["total_p99"] <= baseline_p99 * args.slo_factor
+            )
+        )
+        steps.append(
+            {"offered_rps": rate, "sustained": sustained, **stats, **lag.summary()}
+        )
+        if not sustained:
+            break
+        best = rate
+        rate *= 2
+    return {"max_sustained_rps": best, "steps": steps}
+
+
+async def bench_bot(
+    name: str, bot_file: str, class_name: str, server: FakePoeServer, args
+) -> dict:
+    bot = load_bot(bot_file, class_name)
+    closed = []
+    for users in args.users:
+        closed.append(await closed_loop(bot, server, users, max(args.requests, users)))
+    single_user_p99 = (
+        closed[0]["total_p99"] if closed and closed[0]["users"] == 1 else None
+    )
+    result = {"bot": name, "class": class_name, "file": bot_file, "closed_loop": closed}
+    if not args.skip_rate:
+        result["open_loop"] = await max_sustained_rate(
+            bot, server, args, single_user_p99
+        )
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """Print relative change of the headline numbers against a previous run"""
+    old_bots = {b["bot"]: b for b in baseline["bots"]}
+    keys = (
+        "first_response_p50",
+        "first_image_p50",
+        "total_p50",
+        "total_p99",
+        "throughput_rps",
+        "loop_lag_p99_ms",
+    )
+    for bot in current["bots"]:
+        old = old_bots.get(bot["bot"])
+        if old is None:
+            continue
+        old_levels = {level["users"]: level for level in old["closed_loop"]}
+        for level in bot["closed_loop"]:
+            previous = old_levels.get(level["users"])
+            if previous is None:
+                continue
+            changes = []
+            for key in keys:
+                if level.get(key) is not None and previous.get(key):
+                    change = (level[key] - previous[key]) / previous[key] * 100
+                    changes.append(f"{key} {change:+.1f}%")
+            print(f"{bot['bot']:<24} users={level['users']:<3} " + ", ".join(changes))
+        if "open_loop" in bot and "open_loop" in old:
+            before = old["open_loop"]["max_sustained_rps"]
+            after = bot["open_loop"]["max_sustained_rps"]
+            print(f"{bot['bot']:<24} max sustained rps {before} -> {after}")
+
+
+async def main(args) -> None:
+    random.seed(args.seed)
+    tracing.exporter.output = open(os.devnull, "w")
+    disable_caches()
+    selected = [bot for bot in BOTS if not args.bot or bot[0] in args.bot]
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "settings": {
+            "latency_scale": args.latency_scale,
+            "users": args.users,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "bots": [],
+    }
+    with FakePoeServer(latency_scale=args.latency_scale) as server, route_to(
+        server.base_url
+    ):
+        for name, bot_file, class_name in selected:
+            result = await bench_bot(name, bot_file, class_name, server, args)
+            report["bots"].append(result)
+            for level in result["closed_loop"]:
+                print(
+                    f"{name:<24} users={level['users']:<3} "
+                    f"first={level['first_response_p50']}s "
+                    f"image={level['first_image_p50']}s "
+                    f"total p50={level['total_p50']}s p99={level['total_p99']}s "
+                    f"rps={level['throughput_rps']} "
+                    f"lag p99={level['loop_lag_p99_ms']}ms errors={level['errors']}",
+                    file=sys.stderr,
+                )
+            if "open_loop" in result:
+                rps = result["open_loop"]["max_sustained_rps"]
+                print(f"{name:<24} max sustained rps={rps}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bot", action="append", help="bot name (repeatable), default: all"
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        nargs="+",
+        default=[1, 8, 32],
+        help="concurrent users per closed-loop run",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=32, help="requests per closed-loop run"
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="multiply every fake latency by this",
+    )
+    parser.add_argument(
+        "--start-rate",
+        type=float,
+        default=1.0,
+        help="first offered rate of the open-loop ramp",
+    )
+    parser.add_argument("--max-rate", type=float, default=256.0)
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="seconds per open-loop step"
+    )
+    parser.add_argument(
+        "--slo-factor",
+        type=float,
+        default=2.0,
+        help="allowed p99 growth over the single-user p99",
+    )
+    parser.add_argument(
+        "--skip-rate", action="store_true", help="skip the open-loop max rate search"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON results to compare against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,166 @@
+"""
+
+Warm-pool report: cold starts avoided against the idle container time paid.
+
+Replays request arrival times against the WARM_* policy of botkit.warmpool
+(or --schedule / --min-containers) and a scale-to-zero container that stays up
+--scaledown-window seconds after its last request. A request is a cold start
+when no container is up; the warm pool keeps one up whenever the policy asks
+for containers. The idle cost is the container time the policy adds on top of
+what the traffic keeps alive anyway.
+
+Arrivals come from --trace (one unix timestamp or ISO datetime per line) or,
+without one, from a synthetic bursty week: a few sessions a day, mostly in the
+evening, each a short burst of requests.
+
+    python benchmarks/warm_pool.py --schedule "08:00-23:00=1"
+    python benchmarks/warm_pool.py --trace arrivals.txt --schedule "18:00-01:00=1" \
+        --price-per-hour 0.1
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botkit import warmpool  # noqa: E402
+
+STEP = 60.0
+
+
+def read_trace(path: str) -> list[float]:
+    arrivals = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                arrivals.append(float(line))
+            except ValueError:
+                when = datetime.fromisoformat(line)
+                arrivals.append(
+                    (
+                        when if when.tzinfo else when.replace(tzinfo=timezone.utc)
+                    ).timestamp()
+                )
+    return sorted(arrivals)
+
+
+def synthetic_week(seed: int, sessions_per_day: float) -> list[float]:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+    arrivals = []
+    for day in range(7):
+        for _ in range(max(1, int(rng.gauss(sessions_per_day, sessions_per_day / 3)))):
+            # evenings are busiest
+            hour = rng.choice([9, 12, 13, 18, 19, 20, 21, 21, 22, 22, 23])
+            at = start + day * 86400 + hour * 3600 + rng.uniform(0, 3600)
+            for _ in range(rng.randint(1, 6)):
+                arrivals.append(at)
+                at += rng.expovariate(1 / 40)
+    return sorted(arrivals)
+
+
+def simulate(
+    arrivals: list[float], policy: warmpool.WarmPolicy, scaledown_window: float
+) -> dict:
+    def pooled(at: float) -> int:
+        return policy.containers_at(datetime.fromtimestamp(at, timezone.utc))
+
+    cold_without = cold_with = 0
+    last = None
+    for at in arrivals:
+        up = last is not None and at - last < scaledown_window
+        if not up:
+            cold_without += 1
+            if pooled(at) == 0:
+                cold_with += 1
+        last = at
+
+    # container time the policy keeps up beyond what the traffic does, in STEP slices
+    extra = 0.0
+    index = 0
+    at = arrivals[0] if arrivals else 0.0
+    end = arrivals[-1] if arrivals else 0.0
+    last = None
+    while at <= end:
+        while index < len(arrivals) and arrivals[index] <= at:
+            last = arrivals[index]
+            index += 1
+        natural = 1 if last is not None and at - last < scaledown_window else 0
+        extra += max(0, pooled(at) - natural) * STEP
+        at += STEP
+    return {
+        "requests": len(arrivals),
+        "cold_starts_without_pool": cold_without,
+        "cold_starts_with_pool": cold_with,
+        "cold_starts_avoided": cold_without - cold_with,
+        "extra_idle_container_hours": round(extra / 3600, 2),
+    }
+
+
+def main(args) -> None:
+    policy = warmpool.policy
+    if args.schedule is not None or args.min_containers is not None:
+        policy = warmpool.WarmPolicy(
+            args.min_containers or 0,
+            tuple(warmpool.parse_schedule(args.schedule or "")),
+            args.timezone,
+        )
+    arrivals = (
+        read_trace(args.trace)
+        if args.trace
+        else synthetic_week(args.seed, args.sessions_per_day)
+    )
+    report = simulate(arrivals, policy, args.scaledown_window)
+    report["span_days"] = (
+        round((arrivals[-1] - arrivals[0]) / 86400, 1) if arrivals else 0
+    )
+    if report["cold_starts_avoided"]:
+        report["idle_seconds_per_avoided_cold_start"] = round(
+            report["extra_idle_container_hours"] * 3600 / report["cold_starts_avoided"],
+            1,
+        )
+    if args.price_per_hour is not None:
+        report["extra_idle_cost"] = round(
+            report["extra_idle_container_hours"] * args.price_per_hour, 2
+        )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--trace", help="arrival times, one per line; default: a synthetic bursty week"
+    )
+    parser.add_argument(
+        "--schedule", help='e.g. "08:00-23:00=1", default: WARM_SCHEDULE'
+    )
+    parser.add_argument(
+        "--min-containers", type=int, help="default: WARM_MIN_CONTAINERS"
+    )
+    parser.add_argument("--timezone", default=warmpool.WARM_TIMEZONE)
+    parser.add_argument(
+        "--scaledown-window",
+        type=float,
+        default=300.0,
+        help="idle seconds before scale-down",
+    )
+    parser.add_argument(
+        "--sessions-per-day", type=float, default=6.0, help="synthetic trace only"
+    )
+    parser.add_argument(
+        "--price-per-hour",
+        type=float,
+        help="container price, to turn idle hours into cost",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,9 @@
+"""
+
+Shared helpers for the Poe bots in this repo.
+
+Bot files import from the submodules directly, e.g.
+`from botkit.vision import describe_image`. Deploy from the repo root with
+`PYTHONPATH=.` so the package is importable and mounted.
+
+"""
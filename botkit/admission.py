@@ -0,0 +1,136 @@
+"""
+
+Admission control: bounded concurrency per bot and per downstream model.
+
+A Limiter lets `limit` holders in at once and queues the rest, up to
+`max_queue` waiters for at most `max_wait` seconds each. A request that finds
+the queue full, or waits too long, gets Busy right away instead of piling more
+calls onto Poe; the pipeline answers it with a "busy, retry shortly" message.
+Queue depth, slots in use, wait time and rejections are exported per limiter,
+so scaling can react before latency collapses.
+
+    BOT_CONCURRENCY          requests a bot answers at once (default 32)
+    BOT_QUEUE_SIZE           requests waiting for a bot slot (default 64)
+    BOT_MAX_QUEUE_SECONDS    longest wait for a bot slot (default 10)
+    MODEL_CONCURRENCY        calls in flight per downstream model (default 16)
+    MODEL_QUEUE_SIZE         calls waiting for a model slot (default 64)
+    MODEL_MAX_QUEUE_SECONDS  longest wait for a model slot (default 30)
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncIterator, Optional
+
+from botkit import metrics, tracing
+
+BOT_CONCURRENCY = int(os.environ.get("BOT_CONCURRENCY", "32"))
+BOT_QUEUE_SIZE = int(os.environ.get("BOT_QUEUE_SIZE", "64"))
+BOT_MAX_QUEUE_SECONDS = float(os.environ.get("BOT_MAX_QUEUE_SECONDS", "10"))
+MODEL_CONCURRENCY = int(os.environ.get("MODEL_CONCURRENCY", "16"))
+MODEL_QUEUE_SIZE = int(os.environ.get("MODEL_QUEUE_SIZE", "64"))
+MODEL_MAX_QUEUE_SECONDS = float(os.environ.get("MODEL_MAX_QUEUE_SECONDS", "30"))
+
+
+class Busy(Exception):
+    """No slot could be had: the wait queue was full or the wait too long"""
+
+    def __init__(self, scope: str, name: str, reason: str):
+        super().__init__(f"{scope} {name} busy ({reason})")
+        self.scope = scope
+        self.name = name
+        self.reason = reason
+
+
+class Limiter:
+    def __init__(
+        self,
+        scope: str,
+        name: str,
+        limit: int,
+        max_queue: int,
+        max_wait: Optional[float],
+    ):
+        self.scope = scope
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.waiting = 0
+        self.in_use = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one slot for the body of the `async with`, or raise Busy"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # a semaphore belongs to one loop
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.limit)
+            self.waiting = self.in_use = 0
+        semaphore = self._semaphore
+        started = time.perf_counter()
+        if not semaphore.locked():
+            # a free slot: taken without suspending
+            await semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full")
+            self._set_waiting(self.waiting + 1)
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self._reject("queue_timeout")
+            finally:
+                self._set_waiting(self.waiting - 1)
+        metrics.admission_wait_seconds.observe(
+            time.perf_counter() - started, scope=self.scope, name=self.name
+        )
+        self._set_in_use(self.in_use + 1)
+        try:
+            yield
+        finally:
+            self._set_in_use(self.in_use - 1)
+            semaphore.release()
+
+    def _reject(self, reason: str) -> None:
+        metrics.admission_rejected.inc(scope=self.scope, name=self.name, reason=reason)
+        tracing.event("busy", scope=self.scope, target=self.name, reason=reason)
+        raise Busy(self.scope, self.name, reason)
+
+    def _set_waiting(self, value: int) -> None:
+        self.waiting = value
+        metrics.admission_queue_depth.set(value, scope=self.scope, name=self.name)
+
+    def _set_in_use(self, value: int) -> None:
+        self.in_use = value
+        metrics.admission_in_use.set(value, scope=self.scope, name=self.name)
+
+
+_limiters: dict[tuple[str, str], Limiter] = {}
+
+
+def bot_limiter(bot: str) -> Limiter:
+    """The process-wide limiter of a bot's requests"""
+    found = _limiters.get(("bot", bot))
+    if found is None:
+        found = _limiters["bot", bot] = Limiter(
+            "bot", bot, BOT_CONCURRENCY, BOT_QUEUE_SIZE, BOT_MAX_QUEUE_SECONDS
+        )
+    return found
+
+
+def model_limiter(model: str) -> Limiter:
+    """The process-wide limiter of calls to a downstream bot"""
+    found = _limiters.get(("model", model))
+    if found is None:
+        found = _limiters["model", model] = Limiter(
+            "model", model, MODEL_CONCURRENCY, MODEL_QUEUE_SIZE, MODEL_MAX_QUEUE_SECONDS
+        )
+    return found
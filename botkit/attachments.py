@@ -0,0 +1,165 @@
+"""
+
+Access to the files users attach to their messages.
+
+`fetch(url)` streams the file with a byte cap (ATTACHMENT_MAX_BYTES, checked
+against Content-Length before the body is read, then while it streams) and
+hashes it as it arrives. Concurrent fetches of one URL share a download, and
+the last files fetched are kept for ATTACHMENT_RECENT_SECONDS (at most
+ATTACHMENT_RECENT_BYTES in all), so the checks, the vision cache and
+preprocessing of one request download the photo once. `check_image` reads
+only the header and rejects files that are not an image, or too many pixels
+to decode.
+
+Rejections raise AttachmentError with a message for the user; they are
+"attachment_rejected" events, counted in /metrics.
+
+    ATTACHMENT_MAX_BYTES        largest file fetched (default 20 MB)
+    ATTACHMENT_MAX_PIXELS       largest image accepted (default 100000000)
+    ATTACHMENT_RECENT_SECONDS   fetched files kept for reuse (default 60)
+    ATTACHMENT_RECENT_BYTES     memory those may take (default 64 MB)
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from botkit import httpclient, singleflight, tracing
+from botkit.cache import make_key
+
+try:
+    from PIL import Image
+except ImportError:  # optional dependency
+    Image = None
+
+FETCH_TIMEOUT = 10
+ATTACHMENT_MAX_BYTES = int(
+    os.environ.get("ATTACHMENT_MAX_BYTES", str(20 * 1024 * 1024))
+)
+ATTACHMENT_MAX_PIXELS = int(os.environ.get("ATTACHMENT_MAX_PIXELS", "100000000"))
+ATTACHMENT_RECENT_SECONDS = float(os.environ.get("ATTACHMENT_RECENT_SECONDS", "60"))
+ATTACHMENT_RECENT_BYTES = int(
+    os.environ.get("ATTACHMENT_RECENT_BYTES", str(64 * 1024 * 1024))
+)
+
+# what image files start with, for when Pillow is not installed
+_IMAGE_MAGIC = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"BM")
+
+
+class AttachmentError(Exception):
+    """A file the bot will not work with; `user_text` says why"""
+
+    def __init__(self, reason: str, user_text: str):
+        super().__init__(reason)
+        self.reason = reason
+        self.user_text = user_text
+
+
+@dataclass
+class Fetched:
+    data: bytes
+    # sha256 of data, hex
+    digest: str
+
+
+# url -> (fetched at, file), oldest first
+_recent: OrderedDict[str, tuple[float, Fetched]] = OrderedDict()
+_recent_bytes = 0
+
+
+def _remember(url: str, fetched: Fetched) -> None:
+    global _recent_bytes
+    if url in _recent:
+        _recent_bytes -= len(_recent.pop(url)[1].data)
+    _recent[url] = (time.monotonic(), fetched)
+    _recent_bytes += len(fetched.data)
+    now = time.monotonic()
+    while _recent and (
+        _recent_bytes > ATTACHMENT_RECENT_BYTES
+        or next(iter(_recent.values()))[0] < now - ATTACHMENT_RECENT_SECONDS
+    ):
+        _recent_bytes -= len(_recent.popitem(last=False)[1][1].data)
+
+
+def _too_large(max_bytes: int) -> AttachmentError:
+    return AttachmentError(
+        "too_large",
+        f"The file is too large, please send one under {max_bytes / 2**20:.3g} MB.",
+    )
+
+
+async def _download(url: str, max_bytes: int) -> Fetched:
+    digest = hashlib.sha256()
+    chunks: list[bytes] = []
+    size = 0
+    async with httpclient.client().stream(
+        "GET", url, timeout=FETCH_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        declared = response.headers.get("content-length")
+        if declared is not None and declared.isdigit() and int(declared) > max_bytes:
+            raise _too_large(max_bytes)
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large(max_bytes)
+            digest.update(chunk)
+            chunks.append(chunk)
+    return Fetched(b"".join(chunks), digest.hexdigest())
+
+
+async def fetch(url: str, max_bytes: Optional[int] = None) -> Fetched:
+    """The file at `url` and its hash, see module doc; AttachmentError when too large"""
+    max_bytes = max_bytes or ATTACHMENT_MAX_BYTES
+    entry = _recent.get(url)
+    if entry is not None and entry[0] >= time.monotonic() - ATTACHMENT_RECENT_SECONDS:
+        return entry[1]
+    try:
+        fetched = await singleflight.shared(
+            make_key("attachment", url, str(max_bytes)),
+            lambda: _download(url, max_bytes),
+            "attachment",
+        )
+    except AttachmentError as e:
+        tracing.event("attachment_rejected", reason=e.reason)
+        raise
+    _remember(url, fetched)
+    return fetched
+
+
+def check_image(data: bytes) -> None:
+    """Raise AttachmentError unless `data` looks like an image small enough to decode;
+    reads the header only"""
+    if Image is None:
+        ok = data.startswith(_IMAGE_MAGIC) or (
+            data[:4] == b"RIFF" and data[8:12] == b"WEBP"
+        )
+    else:
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+            ok = True
+        except Image.DecompressionBombError:
+            width = height = ATTACHMENT_MAX_PIXELS
+            ok = True
+        except Exception:
+            ok = False
+        if ok and width * height > ATTACHMENT_MAX_PIXELS:
+            tracing.event("attachment_rejected", reason="too_many_pixels")
+            raise AttachmentError(
+                "too_many_pixels", "The image is too large, please send a smaller one."
+            )
+    if not ok:
+        tracing.event("attachment_rejected", reason="not_an_image")
+        raise AttachmentError("not_an_image", "Please send an image.")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
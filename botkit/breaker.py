@@ -0,0 +1,141 @@
+"""
+
+Circuit breakers for downstream Poe bots, one per bot name and shared by every
+bot in the process.
+
+Each breaker keeps the outcome and duration of the calls of the last
+BREAKER_WINDOW seconds. Once it has BREAKER_MIN_CALLS of them and either the
+error rate reaches BREAKER_ERROR_RATE or the share of calls slower than
+BREAKER_SLOW_CALL seconds reaches BREAKER_SLOW_RATE, it opens: calls to that
+model fail at once with CircuitOpenError, so a stage moves straight on to its
+next fallback model instead of waiting for a failure. After BREAKER_COOLDOWN
+seconds it half-opens and lets one probe call through; success closes it
+again, failure opens it for another cooldown.
+
+    BREAKER_WINDOW       sliding window in seconds (default 60)
+    BREAKER_MIN_CALLS    calls in the window before the breaker may open (default 10)
+    BREAKER_ERROR_RATE   failed share that opens the breaker (default 0.5)
+    BREAKER_SLOW_CALL    seconds after which a call that succeeds is slow (default 60)
+    BREAKER_SLOW_RATE    slow share that opens the breaker (default 0.8)
+    BREAKER_COOLDOWN     seconds open before the probe (default 30)
+
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from botkit import metrics, tracing
+
+BREAKER_WINDOW = float(os.environ.get("BREAKER_WINDOW", "60"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "10"))
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL = float(os.environ.get("BREAKER_SLOW_CALL", "60"))
+BREAKER_SLOW_RATE = float(os.environ.get("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# value of the botkit_circuit_state gauge
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """The model's breaker is open; the call was not made"""
+
+    def __init__(self, model: str):
+        super().__init__(f"circuit open for {model}")
+        self.model = model
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        model: str,
+        window: float = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        error_rate: float = BREAKER_ERROR_RATE,
+        slow_call: float = BREAKER_SLOW_CALL,
+        slow_rate: float = BREAKER_SLOW_RATE,
+        cooldown: float = BREAKER_COOLDOWN,
+    ):
+        self.model = model
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probing = False
+        # (finished at, ok, duration) of the calls in the window
+        self._calls: deque[tuple[float, bool, float]] = deque()
+
+    def allow(self) -> bool:
+        """May a call go out now? In half-open state only one probe at a time"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._set_state(HALF_OPEN)
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record(self, ok: bool, duration: float) -> None:
+        """Outcome of a call that allow() let through"""
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if ok:
+                self._calls.clear()
+                self._set_state(CLOSED)
+            else:
+                self._open(now)
+            return
+        self._calls.append((now, ok, duration))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        if self.state == CLOSED and len(self._calls) >= self.min_calls:
+            failed = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+            slow = sum(
+                1 for _, call_ok, d in self._calls if call_ok and d >= self.slow_call
+            )
+            if (
+                failed / len(self._calls) >= self.error_rate
+                or slow / len(self._calls) >= self.slow_rate
+            ):
+                self._open(now)
+
+    def cancel(self) -> None:
+        """A call that allow() let through was cancelled before it finished"""
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+    def _open(self, now: float) -> None:
+        self.opened_at = now
+        self._calls.clear()
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        metrics.circuit_state.set(_STATE_VALUES[state], model=self.model)
+        tracing.event("circuit", model=self.model, state=state)
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def breaker(model: str) -> CircuitBreaker:
+    """The process-wide breaker of a downstream bot"""
+    found: Optional[CircuitBreaker] = _breakers.get(model)
+    if found is None:
+        found = _breakers[model] = CircuitBreaker(model)
+    return found
@@ -0,0 +1,114 @@
+"""
+
+Small key-value caches used by the bots.
+
+TTLCache keeps entries in memory with LRU + TTL eviction. DiskCache stores JSON
+values as files (e.g. on a Modal Volume) so they survive container restarts.
+LayeredCache puts the two together behind an async get/set.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def make_key(*parts: str) -> str:
+    """Hash the parts into one fixed-length cache key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    def __init__(self, directory: str, ttl: float = 7 * 24 * 3600):
+        self.directory = directory
+        self.ttl = ttl
+        # created on the first write, not at import: a Volume mount can be slow
+        self._created = False
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] < time.time():
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any) -> None:
+        # write then rename so concurrent readers never see a half written file
+        if not self._created:
+            os.makedirs(self.directory, exist_ok=True)
+            self._created = True
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": time.time() + self.ttl, "value": value}, f)
+        os.replace(tmp_path, self._path(key))
+
+
+class LayeredCache:
+    """Memory cache in front of an optional disk cache; disk I/O runs off the loop"""
+
+    def __init__(self, memory: TTLCache, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        loop = asyncio.get_running_loop()
+        value = await loop.run_in_executor(None, self.disk.get, key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.disk.set, key, value)
@@ -0,0 +1,49 @@
+"""
+
+Modal container settings shared by every bot app.
+
+All bots run on one base image with the same pinned packages, so Modal builds
+and caches it once instead of one image per fastapi-poe version. Containers
+start from a memory snapshot taken after the module imports: fastapi_poe
+(with fastapi and pydantic) and modal are most of a cold start, and a restored
+snapshot skips them.
+
+    MEMORY_SNAPSHOT     "0" turns snapshots off (default on)
+    KEEP_WARM           containers each app keeps running (default 0)
+    SCALEDOWN_WINDOW    idle seconds before a container is stopped (default 300)
+
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any
+
+from modal import Image
+
+PYTHON_VERSION = "3.11"
+# one pinned version for every bot, keep requirements.txt in step
+# Pillow is optional for botkit (botkit.imageprep), installed so photos get shrunk
+REQUIREMENTS = ["fastapi-poe==0.0.63", "pillow==12.3.0"]
+
+MEMORY_SNAPSHOT = os.environ.get("MEMORY_SNAPSHOT", "1") != "0"
+KEEP_WARM = int(os.environ.get("KEEP_WARM", "0"))
+SCALEDOWN_WINDOW = int(os.environ.get("SCALEDOWN_WINDOW", "300"))
+
+
+def base_image() -> Image:
+    """The image every bot app is built from, with the botkit package mounted"""
+    return (
+        Image.debian_slim(python_version=PYTHON_VERSION)
+        .pip_install(*REQUIREMENTS)
+        .add_local_python_source("botkit")
+    )
+
+
+def container_options() -> dict[str, Any]:
+    """Keyword arguments for app.function(): snapshot and warm container settings"""
+    return {
+        "enable_memory_snapshot": MEMORY_SNAPSHOT,
+        "min_containers": KEEP_WARM,
+        "scaledown_window": SCALEDOWN_WINDOW,
+    }
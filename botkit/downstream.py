@@ -0,0 +1,202 @@
+"""
+
+Calls to downstream Poe bots (LLMs and image models).
+
+Every bot goes through `stream` / `final_response` instead of calling
+fp.stream_request / fp.get_final_response directly, so each call is traced
+as a span named after its stage ("vision", "llm", "image") with the model,
+prompt size, time to first chunk, response size and attachment count.
+
+`call_with_fallbacks` runs one stage against an ordered list of models with a
+deadline per attempt and optional hedging, so one stuck model call does not
+hold the user until Poe gives up. Every attempt goes through the model's
+circuit breaker (botkit.breaker): a model whose breaker is open is skipped
+without a call. It then waits for a slot of the model's admission limiter
+(botkit.admission), which bounds the calls in flight per model.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+import fastapi_poe as fp
+
+from botkit import admission, httpclient, tracing
+from botkit.breaker import CircuitOpenError, breaker
+
+T = TypeVar("T")
+
+
+async def stream(
+    request: fp.QueryRequest, bot_name: str, stage: str
+) -> AsyncIterator[fp.PartialResponse]:
+    """fp.stream_request for `bot_name`, traced as `stage`"""
+    message = request.query[-1]
+    with tracing.span(
+        stage,
+        model=bot_name,
+        prompt_chars=len(message.content),
+        prompt=tracing.preview(message.content),
+        input_attachments=len(message.attachments),
+    ) as span:
+        response_chars = 0
+        attachments = 0
+        # looked up at call time so fp.stream_request can be redirected
+        # (benchmarks/fake_poe.py); the shared session keeps connections to Poe
+        # open between calls
+        messages = fp.stream_request(
+            request, bot_name, request.access_key, session=httpclient.client()
+        )
+        try:
+            async for msg in messages:
+                if (
+                    response_chars == 0
+                    and attachments == 0
+                    and (msg.text or msg.attachment)
+                ):
+                    span.set(
+                        first_chunk_ms=round(
+                            (time.perf_counter() - span.started) * 1000, 1
+                        )
+                    )
+                response_chars += len(msg.text)
+                if msg.attachment:
+                    attachments += 1
+                yield msg
+        finally:
+            span.set(response_chars=response_chars, attachments=attachments)
+            await messages.aclose()
+
+
+async def final_response(request: fp.QueryRequest, bot_name: str, stage: str) -> str:
+    """Same result as fp.get_final_response, through the traced stream"""
+    chunks: list[str] = []
+    async for msg in stream(request, bot_name, stage):
+        if isinstance(msg, fp.MetaResponse) or msg.is_suggested_reply:
+            continue
+        if msg.is_replace_response:
+            chunks.clear()
+        chunks.append(msg.text)
+    if not chunks:
+        raise fp.BotError(f"Bot {bot_name} sent no response")
+    text = "".join(chunks)
+    tracing.event("response", stage=stage, model=bot_name, text=tracing.preview(text))
+    return text
+
+
+def model_list(model: Union[str, Sequence[str]]) -> list[str]:
+    """A stage's model setting, a name or an ordered fallback list, as a list"""
+    return [model] if isinstance(model, str) else list(model)
+
+
+async def guarded(
+    model: str,
+    attempt: Callable[[str], Awaitable[T]],
+    attempt_timeout: Optional[float] = None,
+) -> T:
+    """
+
+    `attempt(model)` with a deadline, through the model's circuit breaker and
+    within a slot of its admission limiter. The deadline starts once the slot
+    is held; the queue wait has its own limit.
+
+    """
+    circuit = breaker(model)
+    if not circuit.allow():
+        raise CircuitOpenError(model)
+    try:
+        async with admission.model_limiter(model).slot():
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(attempt(model), attempt_timeout)
+            except Exception:
+                circuit.record(False, time.perf_counter() - started)
+                raise
+    except (asyncio.CancelledError, admission.Busy):
+        # no outcome to judge the model by
+        circuit.cancel()
+        raise
+    circuit.record(True, time.perf_counter() - started)
+    return result
+
+
+def failure_reason(error: BaseException) -> str:
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, admission.Busy):
+        return "busy"
+    return "timeout" if isinstance(error, asyncio.TimeoutError) else "error"
+
+
+async def call_with_fallbacks(
+    models: Sequence[str],
+    attempt: Callable[[str], Awaitable[T]],
+    stage: str,
+    attempt_timeout: Optional[float] = None,
+    hedge_after: Optional[float] = None,
+) -> T:
+    """
+
+    Run `attempt(model)` for the first model; when it fails or runs past
+    `attempt_timeout`, move on to the next one. With `hedge_after`, a call
+    still running after that many seconds gets a second one in parallel (the
+    next model, or the same model again when there is only one) and whichever
+    succeeds first wins; the others are cancelled. Raises the last error when
+    every model failed.
+
+    """
+    queue = list(models)
+    if hedge_after is not None and len(queue) == 1:
+        queue.append(queue[0])
+    running: dict[asyncio.Task, str] = {}
+    last_error: Optional[BaseException] = None
+
+    def launch() -> None:
+        model = queue.pop(0)
+        running[asyncio.create_task(guarded(model, attempt, attempt_timeout))] = model
+
+    launch()
+    try:
+        while running:
+            wait = hedge_after if hedge_after is not None and queue else None
+            done, _ = await asyncio.wait(
+                running, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                tracing.event(
+                    "hedge",
+                    stage=stage,
+                    model=queue[0],
+                    slow_model=list(running.values())[-1],
+                )
+                launch()
+                continue
+            for task in done:
+                model = running.pop(task)
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+                tracing.event(
+                    "attempt_failed",
+                    stage=stage,
+                    model=model,
+                    reason=failure_reason(last_error),
+                    error=repr(last_error),
+                )
+            if not running and queue:
+                launch()
+        raise last_error
+    finally:
+        for task in running:
+            task.cancel()
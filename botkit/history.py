@@ -0,0 +1,178 @@
+"""
+
+Conversation history compaction for the bots that continue a conversation.
+
+Extract(history=True) replays the whole conversation on every turn, so the
+prompt, and the LLM's time to its first token, grow with the length of the
+story. Extract(history=CompactHistory(...)) sends instead a rolling summary of
+the older turns plus the turns the summary does not cover yet, at least the
+last `keep_turns`. The summary is cached per conversation and, whenever more
+than `keep_turns` turns are left out of it, the oldest of them are folded in
+by a cheap model in the background: the user does not wait for it, and the
+next turn gets the shorter prompt. A conversation the cache has not seen (a
+new container, an edited or regenerated turn) starts from its last
+HISTORY_MAX_MESSAGES messages while its summary is rebuilt.
+
+Each turn records a "history" event with the messages sent against the
+conversation's length, and every update of a summary a "summary" event.
+
+    HISTORY_KEEP_TURNS     turns always sent as they are (default 3)
+    HISTORY_MAX_MESSAGES   messages sent at most next to the summary (default 16)
+    HISTORY_SUMMARY_CHARS  summaries are cut to this length (default 2000)
+    HISTORY_CACHE_SIZE     conversations kept in memory (default 4096)
+    HISTORY_CACHE_TTL      seconds a summary is kept (default 7 days)
+    HISTORY_CACHE_DIR      also keep summaries on disk, e.g. on a Modal Volume
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Callable, Sequence, Union
+
+import fastapi_poe as fp
+
+from botkit import downstream, tracing
+from botkit.cache import DiskCache, LayeredCache, TTLCache, make_key
+
+HISTORY_KEEP_TURNS = int(os.environ.get("HISTORY_KEEP_TURNS", "3"))
+HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", "16"))
+HISTORY_SUMMARY_CHARS = int(os.environ.get("HISTORY_SUMMARY_CHARS", "2000"))
+HISTORY_CACHE_SIZE = int(os.environ.get("HISTORY_CACHE_SIZE", "4096"))
+HISTORY_CACHE_TTL = float(os.environ.get("HISTORY_CACHE_TTL", str(7 * 24 * 3600)))
+HISTORY_CACHE_DIR = os.environ.get("HISTORY_CACHE_DIR")
+SUMMARY_TIMEOUT = 60
+
+summary_cache = LayeredCache(
+    TTLCache(max_entries=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL),
+    DiskCache(HISTORY_CACHE_DIR, ttl=HISTORY_CACHE_TTL) if HISTORY_CACHE_DIR else None,
+)
+
+# summary updates running, by cache key
+_folding: dict[str, asyncio.Task] = {}
+
+
+def messages_digest(messages: Sequence[fp.ProtocolMessage]) -> str:
+    """Identifies the messages a summary was made from"""
+    return make_key(*(f"{m.role}\0{m.content}" for m in messages))
+
+
+def _done(key: str, task: asyncio.Task) -> None:
+    if _folding.get(key) is task:
+        del _folding[key]
+
+
+def transcript(messages: Sequence[fp.ProtocolMessage]) -> str:
+    return "\n\n".join(f"{m.role}: {m.content}" for m in messages)
+
+
+@dataclass
+class CompactHistory:
+    """
+
+    Send a rolling summary plus the recent turns instead of the whole
+    conversation. `prompt(summary, transcript)` asks `model` for the new
+    summary: the previous one ("" at first) with the turns being folded in;
+    `intro(summary)` is the text of the message that puts the summary in
+    front of the recent turns.
+
+    """
+
+    model: Union[str, Sequence[str]]
+    prompt: Callable[[str, str], str]
+    intro: Callable[[str], str] = (
+        lambda summary: f"Summary of the conversation so far:\n{summary}"
+    )
+    keep_turns: int = HISTORY_KEEP_TURNS
+
+    async def messages(self, ctx) -> list[fp.ProtocolMessage]:
+        """The earlier messages to send before the last one, see module doc"""
+        earlier = ctx.request.query[:-1]
+        keep = self.keep_turns * 2
+        if len(earlier) <= keep:
+            return list(earlier)
+        key = make_key(ctx.bot, "history", ctx.request.conversation_id)
+        entry = await summary_cache.get(key)
+        covered = 0
+        summary = ""
+        if (
+            entry is not None
+            and entry["covered"] <= len(earlier)
+            and (messages_digest(earlier[: entry["covered"]]) == entry["digest"])
+        ):
+            covered, summary = entry["covered"], entry["summary"]
+        recent = earlier[covered:][-max(HISTORY_MAX_MESSAGES, keep) :]
+        if len(earlier) - covered > keep:
+            self._fold_later(
+                ctx.request, key, earlier[: len(earlier) - keep], covered, summary
+            )
+        sent = (
+            [fp.ProtocolMessage(role="system", content=self.intro(summary))]
+            if summary
+            else []
+        ) + list(recent)
+        tracing.event(
+            "history",
+            total=len(earlier),
+            sent=len(sent),
+            covered=covered,
+            summary_chars=len(summary),
+        )
+        return sent
+
+    def _fold_later(
+        self,
+        request: fp.QueryRequest,
+        key: str,
+        upto: Sequence[fp.ProtocolMessage],
+        covered: int,
+        summary: str,
+    ) -> None:
+        task = _folding.get(key)
+        if task is not None and not task.done():
+            return
+        task = asyncio.ensure_future(self._fold(request, key, upto, covered, summary))
+        _folding[key] = task
+        task.add_done_callback(lambda done: _done(key, done))
+
+    async def _fold(
+        self,
+        request: fp.QueryRequest,
+        key: str,
+        upto: Sequence[fp.ProtocolMessage],
+        covered: int,
+        summary: str,
+    ) -> None:
+        """Fold upto[covered:] into the summary and store it; a failure keeps the old"""
+        text = self.prompt(summary, transcript(upto[covered:]))
+        summary_request = request.model_copy(
+            update={"query": [fp.ProtocolMessage(role="user", content=text)]}
+        )
+
+        async def attempt(model: str) -> str:
+            return await downstream.final_response(summary_request, model, "summary")
+
+        try:
+            new_summary = await downstream.call_with_fallbacks(
+                downstream.model_list(self.model), attempt, "summary", SUMMARY_TIMEOUT
+            )
+        except Exception as e:
+            tracing.event("summary", result="failed", error=repr(e))
+            return
+        new_summary = new_summary.strip()[:HISTORY_SUMMARY_CHARS]
+        await summary_cache.set(
+            key,
+            {
+                "covered": len(upto),
+                "digest": messages_digest(upto),
+                "summary": new_summary,
+            },
+        )
+        tracing.event(
+            "summary",
+            result="updated",
+            folded=len(upto) - covered,
+            summary_chars=len(new_summary),
+        )
@@ -0,0 +1,137 @@
+"""
+
+One pooled HTTP client per process for every downstream call.
+
+fp.stream_request opens a new httpx.AsyncClient for each call unless it is
+given a session: a fresh SSL context, TCP connect and TLS handshake every time,
+at least twice per photo bot request (vision, then image). `client()` returns
+a shared AsyncClient with keep-alive and a bounded pool, HTTP/2 when the h2
+package is installed, that downstream.stream, attachment downloads and the
+warm-pool ping all use.
+
+Every request is counted as a pool hit (it reused an open connection) or miss
+(it had to connect), and the connect time of each miss (TCP plus TLS) is
+observed in botkit_http_connect_seconds.
+
+fp.stream_request stops reading at the "done" event, before the end of the
+response body, and httpx drops a connection whose body was not read to the
+end. The transport drains what is left of a body when it is closed (at most
+HTTP_DRAIN_BYTES, HTTP_DRAIN_SECONDS) so the connection goes back to the pool;
+a stream closed by a cancelled task is dropped as before.
+
+    HTTP_MAX_CONNECTIONS      connections open at once (default 100)
+    HTTP_MAX_KEEPALIVE        idle connections kept (default 20)
+    HTTP_KEEPALIVE_EXPIRY     seconds an idle connection is kept (default 60)
+    HTTP2                     "0" turns HTTP/2 off (default on when h2 is installed)
+    HTTP_DRAIN_BYTES          unread body drained to keep a connection (default 65536)
+    HTTP_DRAIN_SECONDS        time allowed for it (default 0.5)
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import os
+import time
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+
+from botkit import metrics
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2 = (
+    os.environ.get("HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+)
+HTTP_DRAIN_BYTES = int(os.environ.get("HTTP_DRAIN_BYTES", "65536"))
+HTTP_DRAIN_SECONDS = float(os.environ.get("HTTP_DRAIN_SECONDS", "0.5"))
+# the same overall timeout fp.stream_request uses for its own clients: image
+# calls stream for minutes
+TIMEOUT = httpx.Timeout(600, connect=10)
+
+
+class _DrainingStream(httpx.AsyncByteStream):
+    """Reads the rest of a partly read body on close, so the connection can be reused"""
+
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self.stream = stream
+        self.exhausted = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+        self.exhausted = True
+
+    async def _drain(self) -> None:
+        drained = 0
+        async for chunk in self.stream:
+            drained += len(chunk)
+            if drained > HTTP_DRAIN_BYTES:
+                return
+        self.exhausted = True
+
+    async def aclose(self) -> None:
+        task = asyncio.current_task()
+        if not self.exhausted and task is not None and not task.cancelling():
+            try:
+                await asyncio.wait_for(self._drain(), HTTP_DRAIN_SECONDS)
+            except (asyncio.TimeoutError, httpx.HTTPError):
+                pass
+        await self.stream.aclose()
+
+
+class _PoolTransport(httpx.AsyncHTTPTransport):
+    """Counts pool hits and misses and times new connections, from httpcore's trace
+    events"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        connect: dict[str, float] = {}
+
+        async def trace(name: str, info: dict[str, Any]) -> None:
+            if name == "connection.connect_tcp.started":
+                connect["started"] = time.perf_counter()
+            elif (
+                name
+                in ("connection.connect_tcp.complete", "connection.start_tls.complete")
+                and connect
+            ):
+                connect["complete"] = time.perf_counter()
+
+        request.extensions = {**request.extensions, "trace": trace}
+        try:
+            response = await super().handle_async_request(request)
+            response.stream = _DrainingStream(response.stream)
+            return response
+        finally:
+            metrics.http_requests.inc(pool="miss" if connect else "hit")
+            if "complete" in connect:
+                metrics.http_connect_seconds.observe(
+                    connect["complete"] - connect["started"]
+                )
+
+
+_client: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def client() -> httpx.AsyncClient:
+    """The shared client of the running event loop"""
+    global _client, _loop
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        # connections belong to one loop
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        _client = httpx.AsyncClient(
+            transport=_PoolTransport(http2=HTTP2, limits=limits),
+            timeout=TIMEOUT,
+            follow_redirects=True,
+        )
+        _loop = loop
+    return _client
@@ -0,0 +1,75 @@
+"""
+
+Generated image cache, keyed by the final image prompt and model.
+
+Once the fields are extracted, the prompt sent to the image model is fixed
+(style prefixes, `--aspect 16:9 --style DESIGN` templates...), so a repeated
+request, a regenerate or a retry after a disconnect asks for the same image
+again. A Render with `cache=True` stores the markdown it returned (attachment
+URLs included) under the prompt, the model list, the attachments it sent and
+the alt text. The image call finishes and is stored even when the user goes
+away mid-request, so their retry is served from the cache. Replies without an
+image (refusals, errors) are not kept. Entries expire after IMAGE_CACHE_TTL
+seconds, which should stay below how long Poe keeps the attachment URLs valid.
+
+    IMAGE_CACHE_MODE   reuse: serve cached images (default)
+                       refresh: always draw a new image, then store it
+                       off: neither read nor write
+    IMAGE_CACHE_SIZE   entries kept in memory (default 1024)
+    IMAGE_CACHE_TTL    seconds an entry is served (default 3600)
+    IMAGE_CACHE_DIR    also keep entries on disk, e.g. on a Modal Volume
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional, Sequence
+
+from botkit import tracing
+from botkit.cache import DiskCache, LayeredCache, TTLCache, make_key
+
+IMAGE_CACHE_MODE = os.environ.get("IMAGE_CACHE_MODE", "reuse")
+IMAGE_CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", "1024"))
+IMAGE_CACHE_TTL = float(os.environ.get("IMAGE_CACHE_TTL", "3600"))
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR")
+
+image_cache = LayeredCache(
+    TTLCache(max_entries=IMAGE_CACHE_SIZE, ttl=IMAGE_CACHE_TTL),
+    DiskCache(IMAGE_CACHE_DIR, ttl=IMAGE_CACHE_TTL) if IMAGE_CACHE_DIR else None,
+)
+
+
+def image_key(
+    prompt: str, models: Sequence[str], attachments: Sequence[str], alt: str
+) -> str:
+    return make_key(
+        "image", prompt, *models, "\0attachments", *attachments, "\0alt", alt
+    )
+
+
+async def cached_image(
+    key: str, render: Callable[[], Awaitable[str]], mode: Optional[str] = None
+) -> str:
+    """The cached markdown for `key`, or render() and store it, per IMAGE_CACHE_MODE"""
+    mode = mode or IMAGE_CACHE_MODE
+    if mode == "off":
+        return await render()
+    if mode == "reuse":
+        markdown = await image_cache.get(key)
+        if markdown is not None:
+            tracing.event("image_cache", result="hit")
+            return markdown
+        tracing.event("image_cache", result="miss")
+    else:
+        tracing.event("image_cache", result="refresh")
+    # shielded: a cancelled request does not cancel the draw-and-store
+    return await asyncio.shield(asyncio.ensure_future(_render_and_store(key, render)))
+
+
+async def _render_and_store(key: str, render: Callable[[], Awaitable[str]]) -> str:
+    markdown = await render()
+    if "![" in markdown:
+        await image_cache.set(key, markdown)
+    return markdown
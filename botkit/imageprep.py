@@ -0,0 +1,137 @@
+"""
+
+Shrink user photos before they go to a vision model.
+
+Phone photos are several megabytes and thousands of pixels wide, while the
+vision prompts only ask for a short description. On a vision cache miss the
+photo bytes (already fetched for the cache key) are decoded, turned upright
+from their EXIF orientation, bounded to PREPROCESS_MAX_SIDE pixels and
+re-encoded as JPEG without EXIF.
+
+Memory is bounded from the header, before anything is decoded. JPEG's draft
+mode decodes straight to 1/2, 1/4 or 1/8 of the full resolution, so a JPEG
+never sits in memory at full size. PNG, WebP and GIF have no such mode and are
+decoded in full, so they are only shrunk up to PREPROCESS_MAX_DECODE_PIXELS;
+larger ones are sent as they are.
+
+The result is uploaded to Poe once per photo content and the vision call gets
+that attachment instead of the original.
+
+Best effort: without Pillow, for small photos, or when anything fails, the
+original attachment is sent. Each outcome is a "preprocess" event; the bytes
+saved and the vision call duration with and without preprocessing are in
+/metrics.
+
+    IMAGE_PREPROCESS        "0" turns it off (default on when Pillow is installed)
+    PREPROCESS_MAX_SIDE     longest side in pixels after resizing (default 1024)
+    PREPROCESS_QUALITY      JPEG quality (default 85)
+    PREPROCESS_MIN_BYTES    smaller photos are sent as they are (default 262144)
+    PREPROCESS_MAX_PIXELS   larger photos are not decoded at all (default 64000000)
+    PREPROCESS_MAX_DECODE_PIXELS
+                            the same for formats decoded at full size, PNG, WebP,
+                            GIF (default 16000000, about 64 MB as RGBA)
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+from typing import Optional
+
+import fastapi_poe as fp
+
+from botkit import singleflight, tracing
+from botkit.cache import TTLCache, make_key
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional dependency
+    Image = None
+
+IMAGE_PREPROCESS = os.environ.get("IMAGE_PREPROCESS", "1") != "0" and Image is not None
+PREPROCESS_MAX_SIDE = int(os.environ.get("PREPROCESS_MAX_SIDE", "1024"))
+PREPROCESS_QUALITY = int(os.environ.get("PREPROCESS_QUALITY", "85"))
+PREPROCESS_MIN_BYTES = int(os.environ.get("PREPROCESS_MIN_BYTES", str(256 * 1024)))
+PREPROCESS_MAX_PIXELS = int(os.environ.get("PREPROCESS_MAX_PIXELS", "64000000"))
+PREPROCESS_MAX_DECODE_PIXELS = int(
+    os.environ.get("PREPROCESS_MAX_DECODE_PIXELS", "16000000")
+)
+
+# uploaded copies by photo content; Poe keeps uploads well past this
+uploads = TTLCache(max_entries=1024, ttl=3600)
+
+
+def shrink(data: bytes) -> Optional[bytes]:
+    """The photo as a bounded JPEG without EXIF, or None when that would not help"""
+    with Image.open(io.BytesIO(data)) as image:
+        # only the header has been read so far
+        width, height = image.size
+        if width * height > PREPROCESS_MAX_PIXELS:
+            return None
+        if (
+            image.format == "JPEG"
+            and max(width, height) <= PREPROCESS_MAX_SIDE
+            and len(data) < PREPROCESS_MIN_BYTES
+        ):
+            return None
+        # JPEG decodes at 1/2, 1/4 or 1/8 scale, still at least the requested
+        # size; draft() is None for formats that decode at full size only
+        drafted = image.draft("RGB", (PREPROCESS_MAX_SIDE, PREPROCESS_MAX_SIDE))
+        if drafted is None and width * height > PREPROCESS_MAX_DECODE_PIXELS:
+            return None
+        upright = ImageOps.exif_transpose(image)
+        upright.thumbnail((PREPROCESS_MAX_SIDE, PREPROCESS_MAX_SIDE))
+        if upright.mode != "RGB":
+            upright = upright.convert("RGB")
+        out = io.BytesIO()
+        # no exif= argument: the metadata is left behind
+        upright.save(out, "JPEG", quality=PREPROCESS_QUALITY, optimize=True)
+    smaller = out.getvalue()
+    return smaller if len(smaller) < len(data) else None
+
+
+async def _upload(
+    request: fp.QueryRequest, data: bytes, digest: str
+) -> Optional[fp.Attachment]:
+    loop = asyncio.get_running_loop()
+    smaller = await loop.run_in_executor(None, shrink, data)
+    if smaller is None:
+        tracing.event("preprocess", result="skipped", bytes_in=len(data))
+        return None
+    # no session=: upload_file closes the client it is given
+    attachment = await fp.upload_file(
+        smaller, file_name=f"{digest[:16]}.jpg", api_key=request.access_key
+    )
+    tracing.event(
+        "preprocess", result="shrunk", bytes_in=len(data), bytes_out=len(smaller)
+    )
+    return attachment
+
+
+async def prepared(
+    request: fp.QueryRequest, data: bytes, digest: str
+) -> fp.QueryRequest:
+    """`request` with its photo replaced by the shrunk upload, or unchanged"""
+    if not IMAGE_PREPROCESS or len(data) < PREPROCESS_MIN_BYTES:
+        return request
+    key = make_key(
+        "preprocess", digest, str(PREPROCESS_MAX_SIDE), str(PREPROCESS_QUALITY)
+    )
+    attachment = uploads.get(key)
+    if attachment is None:
+        try:
+            # hedged and fallback vision calls of one request share the upload
+            attachment = await singleflight.shared(
+                key, lambda: _upload(request, data, digest), "preprocess"
+            )
+        except Exception as e:
+            tracing.event("preprocess", result="failed", error=repr(e))
+            return request
+        # False: not worth shrinking, do not try again
+        uploads.set(key, attachment or False)
+    if not attachment:
+        return request
+    message = request.query[-1].model_copy(update={"attachments": [attachment]})
+    return request.model_copy(update={"query": request.query[:-1] + [message]})
@@ -0,0 +1,536 @@
+"""
+
+In-process metrics with a Prometheus text endpoint.
+
+The numbers come from the tracing hooks, so every request is counted even when
+its trace records are sampled out:
+
+    botkit_request_seconds{bot,outcome}
+        histogram
+    botkit_time_to_first_yield_seconds{bot}
+        histogram
+    botkit_requests_in_flight{bot}
+        gauge
+    botkit_downstream_seconds{bot,model,stage,outcome}
+        histogram, one per downstream call
+    botkit_downstream_first_chunk_seconds{bot,model,stage}
+        histogram
+    botkit_downstream_hedges_total{bot,model,stage}
+        counter, extra calls started next to a slow one
+    botkit_downstream_attempt_failures_total{bot,model,stage,reason}
+        counter, calls given up for the next model
+    botkit_circuit_state{model}
+        gauge, 0 closed, 1 half-open, 2 open
+    botkit_admission_queue_depth{scope,name}
+        gauge, requests (scope bot) or calls (scope model) waiting
+    botkit_admission_in_use{scope,name}
+        gauge, slots held
+    botkit_admission_wait_seconds{scope,name}
+        histogram, time spent queued
+    botkit_admission_rejected_total{scope,name,reason}
+        counter, turned away as busy
+    botkit_coalesced_total{bot,stage}
+        counter, calls served by another request's call
+    botkit_prefetch_total{bot,result}
+        counter, speculative renders: started, hit, changed, malformed, failed
+    botkit_prefetch_head_start_seconds{bot}
+        histogram, how much earlier a kept speculative render started
+    botkit_history_messages_sent{bot}
+        histogram, earlier messages sent with a turn, see botkit.history
+    botkit_history_summaries_total{bot,result}
+        counter, conversation summary updates: updated or failed
+    botkit_http_requests_total{pool}
+        counter, pool hit (reused connection) or miss
+    botkit_http_connect_seconds
+        histogram, TCP + TLS setup of new connections
+    botkit_parse_failures_total{bot,model,reason}
+        counter
+    botkit_parse_retries_total{bot,model}
+        counter, LLM calls made again after an unreadable reply
+    botkit_repairs_total{bot,result}
+        counter, unreadable replies reformatted by a cheap model: fixed, unfixed
+    botkit_errors_total{bot}
+        counter
+    botkit_vision_cache_total{result}
+        counter
+    botkit_attachments_rejected_total{bot,reason}
+        counter, uploads turned away before any model call
+    botkit_vision_seconds{preprocessed}
+        histogram, vision calls with and without a shrunk photo
+    botkit_preprocess_total{result}
+        counter, photo preprocessing: shrunk, skipped, failed
+    botkit_preprocess_bytes_saved_total
+        counter, bytes not sent to vision models
+    botkit_image_cache_total{result}
+        counter
+    botkit_trace_records_dropped_total
+        counter
+    botkit_startup_seconds{phase}
+        gauge, see botkit.startup
+    botkit_cold_starts_total{trigger}
+        counter, first request of a container: user or ping
+    botkit_warm_pings_total
+        counter, see botkit.warmpool
+
+`install(app)` adds GET /metrics to a bot's FastAPI app. The bot URLs are
+public, so it answers only requests with `Authorization: Bearer <METRICS_TOKEN>`
+(401 otherwise); without METRICS_TOKEN set it is a 404.
+
+    METRICS_TOKEN   bearer token of the scraper (default unset: /metrics is off)
+
+"""
+
+from __future__ import annotations
+
+import bisect
+import hmac
+import math
+import os
+from typing import Any, Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# seconds; downstream image calls take tens of seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 120.0)
+
+
+def _label_text(
+    names: tuple[str, ...], values: tuple[str, ...], extra: str = ""
+) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def expose(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_label_text(self.labels, key)} {_number(v)}"
+            for key, v in sorted(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self.values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (the last one is +Inf)], sum, count
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+        counts, totals = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, (total, count)) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                labels = _label_text(self.labels, key, le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{_label_text(self.labels, key)} {_number(total)}"
+            )
+            lines.append(
+                f"{self.name}_count{_label_text(self.labels, key)} {int(count)}"
+            )
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+
+    def add(self, metric: _Metric) -> Any:
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        return (
+            "\n".join(line for metric in self.metrics for line in metric.expose())
+            + "\n"
+        )
+
+
+registry = Registry()
+
+request_seconds = registry.add(
+    Histogram(
+        "botkit_request_seconds",
+        "Bot request duration, first byte in to last yield out",
+        ("bot", "outcome"),
+    )
+)
+first_yield_seconds = registry.add(
+    Histogram(
+        "botkit_time_to_first_yield_seconds",
+        "Time until the bot yields its first PartialResponse",
+        ("bot",),
+    )
+)
+requests_in_flight = registry.add(
+    Gauge(
+        "botkit_requests_in_flight", "Bot requests currently being answered", ("bot",)
+    )
+)
+downstream_seconds = registry.add(
+    Histogram(
+        "botkit_downstream_seconds",
+        "Duration of calls to downstream Poe bots",
+        ("bot", "model", "stage", "outcome"),
+    )
+)
+downstream_first_chunk_seconds = registry.add(
+    Histogram(
+        "botkit_downstream_first_chunk_seconds",
+        "Time to the first text or attachment of a downstream call",
+        ("bot", "model", "stage"),
+    )
+)
+hedges = registry.add(
+    Counter(
+        "botkit_downstream_hedges_total",
+        "Hedged calls started because a downstream call was slow",
+        ("bot", "model", "stage"),
+    )
+)
+attempt_failures = registry.add(
+    Counter(
+        "botkit_downstream_attempt_failures_total",
+        "Downstream calls that failed or timed out before a fallback",
+        ("bot", "model", "stage", "reason"),
+    )
+)
+circuit_state = registry.add(
+    Gauge(
+        "botkit_circuit_state",
+        "Circuit breaker of a downstream bot: 0 closed, 1 half-open, 2 open",
+        ("model",),
+    )
+)
+admission_queue_depth = registry.add(
+    Gauge(
+        "botkit_admission_queue_depth",
+        "Requests or downstream calls waiting for a slot",
+        ("scope", "name"),
+    )
+)
+admission_in_use = registry.add(
+    Gauge(
+        "botkit_admission_in_use", "Admission slots currently held", ("scope", "name")
+    )
+)
+admission_wait_seconds = registry.add(
+    Histogram(
+        "botkit_admission_wait_seconds",
+        "Time spent waiting for an admission slot",
+        ("scope", "name"),
+    )
+)
+admission_rejected = registry.add(
+    Counter(
+        "botkit_admission_rejected_total",
+        "Requests or calls turned away because the queue was full or too slow",
+        ("scope", "name", "reason"),
+    )
+)
+coalesced = registry.add(
+    Counter(
+        "botkit_coalesced_total",
+        "Downstream calls saved by sharing an identical in-flight call",
+        ("bot", "stage"),
+    )
+)
+prefetch = registry.add(
+    Counter(
+        "botkit_prefetch_total",
+        "Speculative image renders started from a partial LLM reply, by outcome",
+        ("bot", "result"),
+    )
+)
+prefetch_head_start_seconds = registry.add(
+    Histogram(
+        "botkit_prefetch_head_start_seconds",
+        "Time a kept speculative render started before the LLM reply finished",
+        ("bot",),
+    )
+)
+history_messages_sent = registry.add(
+    Histogram(
+        "botkit_history_messages_sent",
+        "Earlier conversation messages sent to the LLM with a turn",
+        ("bot",),
+        buckets=(0, 2, 4, 8, 16, 32, 64, 128),
+    )
+)
+history_summaries = registry.add(
+    Counter(
+        "botkit_history_summaries_total",
+        "Updates of a conversation's rolling summary",
+        ("bot", "result"),
+    )
+)
+http_requests = registry.add(
+    Counter(
+        "botkit_http_requests_total",
+        "Outgoing HTTP requests by whether they reused a pooled connection",
+        ("pool",),
+    )
+)
+http_connect_seconds = registry.add(
+    Histogram(
+        "botkit_http_connect_seconds",
+        "Time to open a new outgoing connection, TCP and TLS",
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    )
+)
+parse_failures = registry.add(
+    Counter(
+        "botkit_parse_failures_total",
+        "LLM replies the expected fields could not be read from",
+        ("bot", "model", "reason"),
+    )
+)
+parse_retries = registry.add(
+    Counter(
+        "botkit_parse_retries_total",
+        "LLM calls repeated because the reply missed fields",
+        ("bot", "model"),
+    )
+)
+repairs = registry.add(
+    Counter(
+        "botkit_repairs_total",
+        "Unreadable LLM replies sent to a cheap model to reformat, by outcome",
+        ("bot", "result"),
+    )
+)
+errors = registry.add(
+    Counter("botkit_errors_total", "Errors caught while answering requests", ("bot",))
+)
+vision_cache = registry.add(
+    Counter(
+        "botkit_vision_cache_total", "Vision description cache lookups", ("result",)
+    )
+)
+attachments_rejected = registry.add(
+    Counter(
+        "botkit_attachments_rejected_total",
+        "Attachments rejected as too large or not an image",
+        ("bot", "reason"),
+    )
+)
+vision_seconds = registry.add(
+    Histogram(
+        "botkit_vision_seconds",
+        "Vision calls on a cache miss, by whether the photo was shrunk first",
+        ("preprocessed",),
+    )
+)
+preprocess = registry.add(
+    Counter(
+        "botkit_preprocess_total",
+        "Photos considered for shrinking before a vision call",
+        ("result",),
+    )
+)
+preprocess_bytes_saved = registry.add(
+    Counter(
+        "botkit_preprocess_bytes_saved_total",
+        "Photo bytes not sent to vision models thanks to shrinking",
+    )
+)
+image_cache = registry.add(
+    Counter("botkit_image_cache_total", "Generated image cache lookups", ("result",))
+)
+trace_records_dropped = registry.add(
+    Counter(
+        "botkit_trace_records_dropped_total",
+        "Trace records dropped because the export queue was full",
+    )
+)
+startup_seconds = registry.add(
+    Gauge(
+        "botkit_startup_seconds",
+        "Seconds from process start, or from the snapshot restore, to each phase",
+        ("phase",),
+    )
+)
+cold_starts = registry.add(
+    Counter(
+        "botkit_cold_starts_total",
+        "Containers started, by what their first request was",
+        ("trigger",),
+    )
+)
+warm_pings = registry.add(
+    Counter("botkit_warm_pings_total", "Warm-pool pings received")
+)
+
+
+def record_span(
+    bot: Optional[str], name: str, duration: float, outcome: str, attrs: dict[str, Any]
+) -> None:
+    """Called by tracing for every finished span"""
+    bot = bot or ""
+    if name == "request":
+        request_seconds.observe(duration, bot=bot, outcome=outcome)
+        if "first_yield_ms" in attrs:
+            first_yield_seconds.observe(attrs["first_yield_ms"] / 1000, bot=bot)
+        return
+    model = attrs.get("model")
+    if model is None:
+        return
+    downstream_seconds.observe(
+        duration, bot=bot, model=model, stage=name, outcome=outcome
+    )
+    if "first_chunk_ms" in attrs:
+        downstream_first_chunk_seconds.observe(
+            attrs["first_chunk_ms"] / 1000, bot=bot, model=model, stage=name
+        )
+
+
+def record_event(bot: Optional[str], name: str, attrs: dict[str, Any]) -> None:
+    """Called by tracing for every event"""
+    bot = bot or ""
+    if name == "parse_error":
+        parse_failures.inc(
+            bot=bot, model=attrs.get("model", ""), reason=attrs.get("reason", "")
+        )
+    elif name == "parse_retry":
+        parse_retries.inc(bot=bot, model=attrs.get("model", ""))
+    elif name == "repair" and attrs.get("result") != "failed":
+        # "failed" is one attempt; every repair ends in fixed or unfixed
+        repairs.inc(bot=bot, result=attrs.get("result", ""))
+    elif name == "hedge":
+        hedges.inc(bot=bot, model=attrs.get("model", ""), stage=attrs.get("stage", ""))
+    elif name == "attempt_failed":
+        attempt_failures.inc(
+            bot=bot,
+            model=attrs.get("model", ""),
+            stage=attrs.get("stage", ""),
+            reason=attrs.get("reason", ""),
+        )
+    elif name == "coalesced":
+        coalesced.inc(bot=bot, stage=attrs.get("stage", ""))
+    elif name == "prefetch":
+        prefetch.inc(bot=bot, result=attrs.get("result", ""))
+        if "head_start_ms" in attrs:
+            prefetch_head_start_seconds.observe(attrs["head_start_ms"] / 1000, bot=bot)
+    elif name == "history":
+        history_messages_sent.observe(attrs.get("sent", 0), bot=bot)
+    elif name == "summary":
+        history_summaries.inc(bot=bot, result=attrs.get("result", ""))
+    elif name == "error":
+        errors.inc(bot=bot)
+    elif name == "vision_cache":
+        vision_cache.inc(result=attrs.get("result", ""))
+    elif name == "image_cache":
+        image_cache.inc(result=attrs.get("result", ""))
+    elif name == "attachment_rejected":
+        attachments_rejected.inc(bot=bot, reason=attrs.get("reason", ""))
+    elif name == "preprocess":
+        preprocess.inc(result=attrs.get("result", ""))
+        if "bytes_out" in attrs:
+            preprocess_bytes_saved.inc(attrs["bytes_in"] - attrs["bytes_out"])
+
+
+def _authorized(header: str) -> bool:
+    """True for "Bearer <METRICS_TOKEN>" """
+    expected = f"Bearer {METRICS_TOKEN}"
+    return hmac.compare_digest(header.encode(), expected.encode())
+
+
+def install(app) -> None:
+    """Serve the registry at GET /metrics on a bot's FastAPI app"""
+    # imported here: botkit.startup imports this module
+    from botkit import startup
+
+    # the first code to run after a snapshot restore
+    startup.restored()
+    startup.mark("app_ready")
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def metrics(request: Request) -> PlainTextResponse:
+        if not METRICS_TOKEN:
+            # off: the same answer as a route that does not exist
+            return PlainTextResponse("Not Found", status_code=404)
+        if not _authorized(request.headers.get("authorization", "")):
+            return PlainTextResponse(
+                "Unauthorized", status_code=401, headers={"WWW-Authenticate": "Bearer"}
+            )
+        return PlainTextResponse(
+            registry.expose(), media_type="text/plain; version=0.0.4"
+        )
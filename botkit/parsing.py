@@ -0,0 +1,177 @@
+"""
+
+Read the structured part of an LLM reply.
+
+The bots ask for a ```json block, and get back real JSON, the bare
+"key": "value" pairs of the prompt template (no braces), a list of objects,
+or any of these with prose around them or cut off at the end. Every parse
+tries the strict path first: json.loads on each fenced block and on the whole
+reply, which is one C call for a well-formed reply. Only when that does not
+give the wanted keys does it fall back to the tolerant scan of
+streaming.FieldExtractor, which copes with missing braces, raw newlines,
+escaped quotes and truncated output.
+
+Results are typed: ParseResult says how the value was read ("json",
+"recovered" or "none") and which wanted keys are missing, and
+`require_fields` turns a miss into a ParseError, so the pipeline can ask the
+LLM again instead of sending "ERROR" to an image model.
+
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator, Optional
+
+from botkit import tracing
+from botkit.streaming import FieldExtractor
+
+# a fenced block, closed or cut off by the end of the reply
+_FENCE = re.compile(r"```[a-zA-Z]*[ \t]*\n?(.*?)(?:```|\Z)", re.S)
+
+
+class ParseError(Exception):
+    """The reply did not hold what was asked for"""
+
+    def __init__(self, reason: str, missing: Iterable[str] = (), text: str = ""):
+        self.reason = reason
+        self.missing = tuple(missing)
+        self.text = text
+        super().__init__(
+            f"{reason}: {', '.join(self.missing)}" if self.missing else reason
+        )
+
+
+@dataclass
+class ParseResult:
+    # a dict of fields, or a list of objects; None when nothing was read
+    value: Any
+    # "json" (strict parse), "recovered" (tolerant scan) or "none"
+    method: str
+    missing: tuple[str, ...] = ()
+
+    @property
+    def ok(self) -> bool:
+        return self.value is not None and not self.missing
+
+
+def _blocks(text: str) -> Iterator[str]:
+    """Fenced blocks first, then the whole reply"""
+    for match in _FENCE.finditer(text):
+        yield match.group(1).strip()
+    yield text.strip()
+
+
+def loads(block: str) -> Optional[Any]:
+    """json.loads, also for bare "key": "value" pairs; None when it is not JSON"""
+    if not block:
+        return None
+    try:
+        # strict=False lets raw newlines through inside strings
+        return json.loads(block, strict=False)
+    except ValueError:
+        pass
+    if block[0] == '"':
+        try:
+            return json.loads("{" + block.rstrip().rstrip(",") + "}", strict=False)
+        except ValueError:
+            pass
+    return None
+
+
+def _strings(obj: dict) -> dict[str, str]:
+    return {
+        k: v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+        for k, v in obj.items()
+        if v is not None
+    }
+
+
+def parse_fields(text: str, wanted: Iterable[str]) -> ParseResult:
+    """The wanted string fields of a reply holding one object"""
+    wanted = tuple(wanted)
+    fields: dict[str, str] = {}
+    for block in _blocks(text):
+        obj = loads(block)
+        if isinstance(obj, dict):
+            fields.update(
+                {
+                    k: v
+                    for k, v in _strings(obj).items()
+                    if k in wanted and k not in fields
+                }
+            )
+            if all(k in fields for k in wanted):
+                return ParseResult(fields, "json")
+    extractor = FieldExtractor(wanted)
+    extractor.feed(text)
+    recovered = {**extractor.fields, **fields}
+    missing = tuple(k for k in wanted if k not in recovered)
+    return ParseResult(recovered or None, "recovered" if recovered else "none", missing)
+
+
+def parse_items(text: str, key: str) -> ParseResult:
+    """The objects with `key` of a reply holding a list of them"""
+    for block in _blocks(text):
+        obj = loads(block)
+        if isinstance(obj, dict):
+            # {"items": [...]}: the first list inside
+            obj = next((v for v in obj.values() if isinstance(v, list)), None)
+        if isinstance(obj, list):
+            items = [
+                _strings(item) for item in obj if isinstance(item, dict) and key in item
+            ]
+            if items:
+                return ParseResult(items, "json")
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        obj = loads(text[start : end + 1])
+        if isinstance(obj, list):
+            items = [
+                _strings(item) for item in obj if isinstance(item, dict) and key in item
+            ]
+            if items:
+                return ParseResult(items, "json")
+    items = []
+    extractor = FieldExtractor(
+        on_object=lambda obj: items.append(obj) if key in obj else None
+    )
+    extractor.feed(text)
+    return ParseResult(
+        items or None, "recovered" if items else "none", () if items else (key,)
+    )
+
+
+def require_fields(
+    fields: dict[str, str],
+    text: str,
+    wanted: Iterable[str],
+    model: str,
+    stage: str = "llm",
+) -> dict[str, str]:
+    """
+
+    `fields` read while streaming, completed from the full `text` when some
+    are missing; raises ParseError, recorded as a "parse_error" event, when
+    any wanted field is still missing.
+
+    """
+    wanted = tuple(wanted)
+    if all(k in fields for k in wanted):
+        return fields
+    result = parse_fields(text, wanted)
+    merged = {**(result.value or {}), **fields}
+    missing = [k for k in wanted if k not in merged]
+    if missing:
+        tracing.event(
+            "parse_error",
+            stage=stage,
+            model=model,
+            reason="missing fields",
+            missing=missing,
+            text=tracing.preview(text),
+        )
+        raise ParseError("missing fields", missing, text)
+    return merged
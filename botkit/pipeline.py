@@ -0,0 +1,704 @@
+"""
+
+Declarative bot pipelines.
+
+Every bot here has the same shape: check the attachment, describe the photo
+with a vision model and/or extract fields from an LLM reply, compose an image
+prompt, render it with an image model and emit markdown. A bot declares its
+stages and the engine runs them:
+
+    class Pic2PixarBot(PipelineBot):
+        pipeline = Pipeline(
+            "pixar-plus",
+            require_image=True,
+            describe=Describe(LLM_MODEL, VISION_PROMPT),
+            compose=compose_image_prompt,
+            render=Render(IMAGE_MODEL),
+        )
+
+The engine owns what used to be copied into every get_response: request
+copies per downstream call, streaming field extraction, rendering several
+images concurrently as their prompts arrive, timeouts, error handling and
+tracing. Prompts and compose functions get a Context with the user's text
+and the fields extracted so far.
+
+A stage's model may be an ordered list, e.g. Render(["FLUX-pro-1.1",
+"Playground-v3"], hedge_after=20): each call has a deadline (attempt_timeout,
+DOWNSTREAM_LLM_TIMEOUT / DOWNSTREAM_IMAGE_TIMEOUT by default) after which the
+next model is tried, and hedge_after starts the next model alongside a slow
+call, see downstream.call_with_fallbacks.
+
+Extract(..., prefetch="image_prompt") renders speculatively: the image call
+starts as soon as that field's value closes in the LLM stream, while the rest
+of the reply is still coming. Once the reply is in, the image is kept if the
+composed prompt is the same and every field arrived; otherwise it is cancelled
+and the normal path runs. Each outcome is a "prefetch" event, and the time the
+image call gained is in botkit_prefetch_head_start_seconds.
+
+`variants` fans one description out to several images: every dict it returns
+becomes an item over ctx.fields (a "style" for compose, a "model" for Render),
+so the vision or LLM call is made once and the images are drawn concurrently
+and streamed as they arrive.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Callable, Optional, Sequence, Union
+
+import fastapi_poe as fp
+
+from botkit import admission, downstream, singleflight, tracing
+from botkit.attachments import AttachmentError, check_image, fetch
+from botkit.cache import make_key
+from botkit.history import CompactHistory
+from botkit.image_cache import cached_image, image_key
+from botkit.parsing import ParseError, parse_fields, require_fields
+from botkit.repair import Repair
+from botkit.streaming import FieldExtractor, stream_fields
+from botkit.vision import describe_image
+
+ERROR_TEXT = "Something went wrong. Please try again or contact the admin."
+BUSY_TEXT = "The bot is busy right now, please retry shortly."
+# default deadline of one downstream call (seconds); a stage may then try its next model
+LLM_TIMEOUT = float(os.environ.get("DOWNSTREAM_LLM_TIMEOUT", "60"))
+IMAGE_TIMEOUT = float(os.environ.get("DOWNSTREAM_IMAGE_TIMEOUT", "120"))
+
+
+@dataclass
+class Context:
+    request: fp.QueryRequest
+    # the user's last message as sent
+    text: str
+    # id of the bot answering, see Pipeline
+    bot: str = ""
+    fields: dict[str, str] = field(default_factory=dict)
+    # one entry per image to render, with its index in `images`
+    items: list[dict] = field(default_factory=list)
+    # rendered markdown per item, None while it is being drawn
+    images: list[Optional[str]] = field(default_factory=list)
+    # the speculative render of the first item, see Extract.prefetch
+    prefetched: Optional[asyncio.Task] = None
+
+    @property
+    def message(self) -> fp.ProtocolMessage:
+        return self.request.query[-1]
+
+
+Prompt = Union[str, Callable[[Context], str]]
+# a model name, or an ordered list: the first one is used, the next ones are fallbacks
+Models = Union[str, Sequence[str]]
+
+
+def _prompt_text(prompt: Prompt, ctx: Context) -> str:
+    return prompt(ctx) if callable(prompt) else prompt
+
+
+def _with_last_message(
+    ctx: Context, content: str, attachments: bool, history: bool = False
+) -> fp.QueryRequest:
+    """A copy of the request whose last message is `content`; the original stays"""
+    message = ctx.message.model_copy(
+        update={
+            "content": content,
+            "attachments": ctx.message.attachments if attachments else [],
+        }
+    )
+    query = (ctx.request.query[:-1] if history else []) + [message]
+    return ctx.request.model_copy(update={"query": query})
+
+
+@dataclass
+class Describe:
+    """Ask a vision model about the attached photo, cached by photo content"""
+
+    model: Models
+    prompt: Prompt
+    field: str = "image_prompt"
+    # whole stage, all attempts included
+    timeout: Optional[float] = None
+    # one call; after it the next model is tried
+    attempt_timeout: Optional[float] = LLM_TIMEOUT
+    # start a second call when the first is slower than this
+    hedge_after: Optional[float] = None
+    # send a shrunk copy of the photo, see botkit.imageprep
+    preprocess: bool = True
+
+    async def run(self, ctx: Context) -> dict[str, str]:
+        request = _with_last_message(
+            ctx, _prompt_text(self.prompt, ctx), attachments=True
+        )
+
+        async def attempt(model: str) -> str:
+            return await describe_image(request, model, self.field, self.preprocess)
+
+        description = await downstream.call_with_fallbacks(
+            downstream.model_list(self.model),
+            attempt,
+            "vision",
+            self.attempt_timeout,
+            self.hedge_after,
+        )
+        return {self.field: description}
+
+
+@dataclass
+class Extract:
+    """Stream an LLM reply and pick out `fields`, stopping once all are in"""
+
+    model: Models
+    prompt: Prompt
+    fields: tuple[str, ...]
+    # send the whole conversation, not only the last message; a CompactHistory
+    # sends a summary of the older turns and the recent ones
+    history: Union[bool, CompactHistory] = False
+    # forward the user's attachments to the LLM
+    attachments: bool = True
+    timeout: Optional[float] = None
+    attempt_timeout: Optional[float] = LLM_TIMEOUT
+    hedge_after: Optional[float] = None
+    # concurrent requests with the same normalized text (and attachments)
+    # share one LLM call, see botkit.singleflight
+    coalesce: bool = False
+    # start rendering once this field is in, before the rest of the reply;
+    # not with coalesce, where only one of the requests sees the stream
+    prefetch: Optional[str] = None
+    # ask the same model again this many times when its reply misses fields,
+    # before the next model; each is a call to declare in get_settings. Either
+    # way a request never renders a prompt with a field missing
+    parse_retries: int = 0
+    # have a cheap model reformat a reply that misses fields, before asking again
+    repair: Optional[Repair] = None
+
+    async def run(
+        self, ctx: Context, on_field: Optional[Callable[[str, str], None]] = None
+    ) -> dict[str, str]:
+        request = _with_last_message(
+            ctx, _prompt_text(self.prompt, ctx), self.attachments, self.history is True
+        )
+        if isinstance(self.history, CompactHistory):
+            earlier = await self.history.messages(ctx)
+            request = request.model_copy(update={"query": earlier + request.query})
+
+        async def attempt(model: str) -> dict[str, str]:
+            for retry in range(self.parse_retries + 1):
+                fields, text = await stream_fields(
+                    request, model, self.fields, on_field
+                )
+                try:
+                    return require_fields(fields, text, self.fields, model)
+                except ParseError:
+                    if self.repair is not None:
+                        fixed = await self.repair.run(request, text, self._parse)
+                        if fixed:
+                            return {**fixed, **fields}
+                    if retry == self.parse_retries:
+                        raise
+                    tracing.event("parse_retry", stage="llm", model=model)
+
+        async def call() -> dict[str, str]:
+            return await downstream.call_with_fallbacks(
+                downstream.model_list(self.model),
+                attempt,
+                "llm",
+                self.attempt_timeout,
+                self.hedge_after,
+            )
+
+        if not self.coalesce:
+            return await call()
+        messages = ctx.request.query if self.history else [ctx.message]
+        key = make_key(
+            ctx.bot,
+            "llm",
+            *(singleflight.normalize(m.content) for m in messages),
+            *(a.url for a in ctx.message.attachments if self.attachments),
+        )
+        # a copy each, compose functions may add to the fields
+        return dict(await singleflight.shared(key, call, "llm"))
+
+    def _parse(self, text: str) -> Optional[dict[str, str]]:
+        result = parse_fields(text, self.fields)
+        return result.value if result.ok else None
+
+
+@dataclass
+class ExtractItems:
+    """
+
+    Stream an LLM reply holding a list of {...} objects; every object with
+    `key` becomes an item as soon as it closes, so its image can start before
+    the reply is finished. `fallback(text)` parses the full reply when no
+    object could be read while streaming; it may raise ParseError, recorded
+    against the model that answered. The next model is only tried
+    while no item was sent on yet, so items are never hedged.
+
+    `attempt_timeout` bounds the wait for the first item; after that a long
+    reply streams on for as long as its chunks keep coming, at most
+    `attempt_timeout` apart. A reply that fails or stalls once items were
+    sent on ends there, and the items already read are rendered.
+
+    """
+
+    model: Models
+    prompt: Prompt
+    key: str
+    fallback: Optional[Callable[[str], Optional[list[dict]]]] = None
+    # when fallback finds nothing either, have a cheap model reformat the reply
+    # and run fallback on that; needs fallback
+    repair: Optional[Repair] = None
+    # yielded when no item could be read at all
+    empty_text: str = ERROR_TEXT
+    attachments: bool = True
+    timeout: Optional[float] = None
+    # seconds to the first item, then between chunks
+    attempt_timeout: Optional[float] = LLM_TIMEOUT
+
+    async def run(self, ctx: Context, on_item: Callable[[dict], None]) -> None:
+        request = _with_last_message(
+            ctx, _prompt_text(self.prompt, ctx), self.attachments
+        )
+        models = downstream.model_list(self.model)
+        found = 0
+
+        def on_object(obj: dict) -> None:
+            nonlocal found
+            if self.key in obj:
+                found += 1
+                on_item(obj)
+
+        for i, model in enumerate(models):
+            try:
+                # no deadline on the whole reply, _read keeps its own
+                text = await downstream.guarded(
+                    model, lambda m: self._read(request, m, on_object)
+                )
+                break
+            except Exception as e:
+                if not found and i == len(models) - 1:
+                    raise
+                tracing.event(
+                    "attempt_failed",
+                    stage="llm",
+                    model=model,
+                    reason=downstream.failure_reason(e),
+                    error=repr(e),
+                    items=found,
+                )
+                if found:
+                    # the user has seen these; render them rather than fail the request
+                    return
+        if not found and self.fallback is not None:
+            try:
+                items = self.fallback(text)
+            except ParseError as e:
+                tracing.event(
+                    "parse_error",
+                    stage="llm",
+                    model=model,
+                    reason=e.reason,
+                    text=tracing.preview(text),
+                )
+                items = None
+            if not items and self.repair is not None:
+                items = await self.repair.run(request, text, self.fallback)
+            for item in items or []:
+                on_item(item)
+
+    async def _read(
+        self, request: fp.QueryRequest, model: str, on_object: Callable[[dict], None]
+    ) -> str:
+        items = 0
+
+        def counted(obj: dict) -> None:
+            nonlocal items
+            if self.key in obj:
+                items += 1
+            on_object(obj)
+
+        extractor = FieldExtractor(on_object=counted)
+        chunks: list[str] = []
+        loop = asyncio.get_running_loop()
+        limit = self.attempt_timeout
+        async with asyncio.timeout(limit) as deadline:
+            async for msg in downstream.stream(request, model, "llm"):
+                if isinstance(msg, fp.MetaResponse) or msg.is_suggested_reply:
+                    continue
+                if msg.is_replace_response:
+                    chunks.clear()
+                    extractor.reset()
+                chunks.append(msg.text)
+                extractor.feed(msg.text)
+                if items and limit is not None:
+                    # past the first item only a stalled stream times out
+                    deadline.reschedule(loop.time() + limit)
+        return "".join(chunks)
+
+
+@dataclass
+class Render:
+    """Draw a composed prompt with an image model and return it as markdown"""
+
+    model: Models
+    # send the user's photo along, for models that remix it
+    keep_attachment: bool = False
+    # images drawn at once per request, within the calls declared in get_settings
+    concurrency: int = 1
+    # alt text of the image markdown; {n} is the 1-based item number
+    alt: str = "image"
+    # markdown shown in place of an image that failed; None fails the request
+    failed_text: Optional[str] = None
+    timeout: Optional[float] = None
+    attempt_timeout: Optional[float] = IMAGE_TIMEOUT
+    hedge_after: Optional[float] = None
+    # concurrent requests with the same prompt share one image; off, every user
+    # gets an image of their own even when the LLM call was coalesced
+    coalesce: bool = False
+    # reuse images drawn before for the same prompt, see botkit.image_cache;
+    # `cache_mode` overrides IMAGE_CACHE_MODE for this stage
+    cache: bool = False
+    cache_mode: Optional[str] = None
+
+    async def run(
+        self, ctx: Context, prompt: str, index: int, model: Optional[Models] = None
+    ) -> str:
+        """Draw `prompt` as item `index`; `model` replaces the stage's models"""
+        if not prompt:
+            raise ValueError("empty image prompt")
+        request = _with_last_message(ctx, prompt, self.keep_attachment)
+
+        async def attempt(model: str) -> str:
+            return await self._render(request, model, index)
+
+        models = downstream.model_list(model or self.model)
+        attachments = (
+            [a.url for a in ctx.message.attachments] if self.keep_attachment else []
+        )
+
+        async def draw() -> str:
+            return await downstream.call_with_fallbacks(
+                models, attempt, "image", self.attempt_timeout, self.hedge_after
+            )
+
+        async def call() -> str:
+            if not self.cache:
+                return await draw()
+            return await cached_image(
+                image_key(prompt, models, attachments, self.alt.format(n=index + 1)),
+                draw,
+                self.cache_mode,
+            )
+
+        if not self.coalesce:
+            return await call()
+        return await singleflight.shared(
+            make_key(ctx.bot, "image", prompt, str(index), *attachments), call, "image"
+        )
+
+    async def _render(self, request: fp.QueryRequest, model: str, index: int) -> str:
+        files: list[fp.Attachment] = []
+        text: list[str] = []
+        async for msg in downstream.stream(request, model, "image"):
+            if isinstance(msg, fp.MetaResponse) or msg.is_suggested_reply:
+                continue
+            if msg.is_replace_response:
+                text.clear()
+            text.append(msg.text)
+            if msg.attachment:
+                files.append(msg.attachment)
+        if files:
+            alt = self.alt.format(n=index + 1)
+            return "".join(f"![{alt}]({file.url})\n\n" for file in files)
+        if "".join(text).strip():
+            return "".join(text)
+        raise fp.BotError(f"Bot {model} sent no image")
+
+
+def images_markdown(ctx: Context) -> str:
+    return "".join(image or "" for image in ctx.images)
+
+
+class _Prefetch:
+    """The speculative render of a Pipeline whose Extract has `prefetch` set"""
+
+    def __init__(self, pipeline: Pipeline, ctx: Context):
+        self.pipeline = pipeline
+        self.ctx = ctx
+        self.prompt: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.started = 0.0
+
+    def on_field(self, key: str, value: str) -> None:
+        # a hedged or fallback LLM call may send the field again: the first one wins
+        if key != self.pipeline.extract.prefetch or self.task is not None:
+            return
+        try:
+            prompt = self.pipeline.compose(self.ctx, {**self.ctx.fields, key: value})
+        except Exception:
+            # compose needs more than this field, nothing to start
+            return
+        self.prompt = prompt
+        self.started = time.perf_counter()
+        self.task = asyncio.create_task(self.pipeline.render.run(self.ctx, prompt, 0))
+        tracing.event("prefetch", result="started", field=key)
+
+    def settle(self, fields: dict[str, str]) -> Optional[asyncio.Task]:
+        """The render to keep for the finished reply, or None after cancelling it"""
+        if self.task is None:
+            return None
+        try:
+            prompt = self.pipeline.compose(self.ctx, {**self.ctx.fields, **fields})
+        except Exception:
+            prompt = None
+        if prompt != self.prompt:
+            self.cancel("changed")
+            return None
+        tracing.event(
+            "prefetch",
+            result="hit",
+            head_start_ms=round((time.perf_counter() - self.started) * 1000, 1),
+        )
+        return self.task
+
+    def cancel(self, result: str, **attrs) -> None:
+        if self.task is None:
+            return
+        if not self.task.done():
+            self.task.cancel()
+        elif not self.task.cancelled():
+            # finished, or failed, for nothing; read the exception so it is not
+            # logged as lost
+            self.task.exception()
+        tracing.event("prefetch", result=result, **attrs)
+
+
+class Pipeline:
+    def __init__(
+        self,
+        bot: str,
+        *,
+        compose: Callable[[Context, dict], str],
+        render: Render,
+        describe: Optional[Describe] = None,
+        extract: Union[Extract, ExtractItems, None] = None,
+        require_image: bool = False,
+        preview: Optional[Callable[[Context], str]] = None,
+        emit: Callable[[Context], str] = images_markdown,
+        progressive: bool = False,
+        variants: Optional[Callable[[Context], list[dict]]] = None,
+        footer: Optional[str] = None,
+        error_text: Union[str, Callable[[Exception], str]] = ERROR_TEXT,
+    ):
+        """
+
+        bot          id used in traces and metrics
+        compose      (ctx, item) -> image prompt; item is ctx.fields unless
+                     extract is ExtractItems
+        preview      text yielded once the fields are in, before any image
+        emit         the message from ctx.items / ctx.images
+        progressive  re-send emit() as a replace response whenever an item
+                     or an image arrives, instead of once at the end
+        variants     ctx -> dicts, one image each, merged over the fields;
+                     "model" in a dict replaces render's models. Rendered
+                     progressively when there is more than one
+        footer       yielded after everything else
+
+        """
+        self.bot = bot
+        self.compose = compose
+        self.render = render
+        self.describe = describe
+        self.extract = extract
+        self.require_image = require_image
+        self.preview = preview
+        self.emit = emit
+        self.progressive = progressive
+        self.variants = variants
+        self.footer = footer
+        self.error_text = error_text
+
+    async def run(self, request: fp.QueryRequest) -> AsyncIterable[fp.PartialResponse]:
+        ctx = Context(request=request, text=request.query[-1].content, bot=self.bot)
+        attachments = ctx.message.attachments
+        if self.require_image and (
+            len(attachments) != 1 or not attachments[0].content_type.startswith("image")
+        ):
+            yield fp.PartialResponse(text="Please send an image.")
+            return
+        try:
+            # at most BOT_CONCURRENCY requests of this bot at once, see botkit.admission
+            async with admission.bot_limiter(self.bot).slot():
+                async for response in self._run(ctx):
+                    yield response
+        except admission.Busy:
+            yield fp.PartialResponse(text=BUSY_TEXT)
+        except Exception as e:
+            tracing.event("error", error=repr(e))
+            text = self.error_text(e) if callable(self.error_text) else self.error_text
+            yield fp.PartialResponse(text=text)
+        finally:
+            if ctx.prefetched is not None:
+                ctx.prefetched.cancel()
+
+    async def _run(self, ctx: Context) -> AsyncIterable[fp.PartialResponse]:
+        if self.require_image:
+            # a file too large or not an image is turned away before any model call;
+            # the photo stays in botkit.attachments for the vision stage
+            try:
+                check_image((await fetch(ctx.message.attachments[0].url)).data)
+            except AttachmentError as e:
+                yield fp.PartialResponse(text=e.user_text)
+                return
+            except Exception as e:
+                # the vision model may still be able to fetch it
+                tracing.event("attachment", result="fetch_failed", error=repr(e))
+        if self.describe is not None:
+            ctx.fields.update(
+                await asyncio.wait_for(self.describe.run(ctx), self.describe.timeout)
+            )
+        if isinstance(self.extract, Extract):
+            # a variant's prompt is not the one composed from the fields alone
+            if (
+                self.extract.prefetch is None
+                or self.extract.coalesce
+                or self.variants is not None
+            ):
+                ctx.fields.update(
+                    await asyncio.wait_for(self.extract.run(ctx), self.extract.timeout)
+                )
+            else:
+                ctx.fields.update(await self._extract_with_prefetch(ctx))
+        if self.preview is not None:
+            yield fp.PartialResponse(text=self.preview(ctx))
+
+        # ("item", fields), ("image", (index, markdown)), ("done", None)
+        # or ("error", exception)
+        events: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.render.concurrency)
+        tasks: list[asyncio.Task] = []
+        items_done = False
+        images_done = 0
+        reader = asyncio.create_task(self._read_items(ctx, events))
+        try:
+            while not items_done or images_done < len(tasks):
+                kind, payload = await events.get()
+                if kind == "error":
+                    raise payload
+                if kind == "item":
+                    ctx.items.append(payload)
+                    ctx.images.append(None)
+                    tasks.append(
+                        asyncio.create_task(
+                            self._render_item(
+                                ctx, len(ctx.items) - 1, semaphore, events
+                            )
+                        )
+                    )
+                elif kind == "image":
+                    index, markdown = payload
+                    ctx.images[index] = markdown
+                    images_done += 1
+                else:
+                    items_done = True
+                    if not ctx.items:
+                        yield fp.PartialResponse(text=self.extract.empty_text)
+                        return
+                    continue
+                if self._progressive(ctx):
+                    yield fp.PartialResponse(
+                        text=self.emit(ctx), is_replace_response=True
+                    )
+        finally:
+            reader.cancel()
+            for task in tasks:
+                task.cancel()
+
+        if not self._progressive(ctx):
+            yield fp.PartialResponse(text=self.emit(ctx))
+        if self.footer:
+            yield fp.PartialResponse(text=self.footer)
+
+    def _progressive(self, ctx: Context) -> bool:
+        return self.progressive or (self.variants is not None and len(ctx.items) > 1)
+
+    async def _extract_with_prefetch(self, ctx: Context) -> dict[str, str]:
+        prefetch = _Prefetch(self, ctx)
+        try:
+            fields = await asyncio.wait_for(
+                self.extract.run(ctx, prefetch.on_field), self.extract.timeout
+            )
+        except ParseError as e:
+            # every model's reply missed fields
+            prefetch.cancel("malformed", missing=list(e.missing))
+            raise
+        except BaseException:
+            prefetch.cancel("failed")
+            raise
+        ctx.prefetched = prefetch.settle(fields)
+        return fields
+
+    async def _read_items(self, ctx: Context, events: asyncio.Queue) -> None:
+        try:
+            if isinstance(self.extract, ExtractItems):
+
+                def on_item(item: dict) -> None:
+                    events.put_nowait(("item", item))
+
+                await asyncio.wait_for(
+                    self.extract.run(ctx, on_item), self.extract.timeout
+                )
+            elif self.variants is not None:
+                # all at once, so the message is progressive from the first item on
+                for variant in self.variants(ctx):
+                    events.put_nowait(("item", {**ctx.fields, **variant}))
+            else:
+                events.put_nowait(("item", ctx.fields))
+            events.put_nowait(("done", None))
+        except Exception as e:
+            events.put_nowait(("error", e))
+
+    async def _render_item(
+        self,
+        ctx: Context,
+        index: int,
+        semaphore: asyncio.Semaphore,
+        events: asyncio.Queue,
+    ) -> None:
+        try:
+            async with semaphore:
+                if index == 0 and ctx.prefetched is not None:
+                    # already drawing the same prompt, see _Prefetch
+                    markdown = await asyncio.wait_for(
+                        ctx.prefetched, self.render.timeout
+                    )
+                else:
+                    item = ctx.items[index]
+                    prompt = self.compose(ctx, item)
+                    model = item.get("model") if self.variants is not None else None
+                    markdown = await asyncio.wait_for(
+                        self.render.run(ctx, prompt, index, model), self.render.timeout
+                    )
+        except Exception as e:
+            if self.render.failed_text is None:
+                events.put_nowait(("error", e))
+                return
+            tracing.event("error", stage="image", item=index + 1, error=repr(e))
+            markdown = self.render.failed_text
+        events.put_nowait(("image", (index, markdown)))
+
+
+class PipelineBot(fp.PoeBot):
+    """A PoeBot answering with its class-level `pipeline`"""
+
+    pipeline: Pipeline
+
+    def get_response(
+        self, request: fp.QueryRequest
+    ) -> AsyncIterable[fp.PartialResponse]:
+        return tracing.trace_request(
+            self.pipeline.bot, request, self.pipeline.run(request)
+        )
@@ -0,0 +1,120 @@
+"""
+
+Fix an unreadable LLM reply with a cheap model instead of a new generation.
+
+When a reply has the content but not the shape (a missing bracket, single
+quotes, prose in the middle of the JSON), asking the big model again costs a
+full generation. Repair sends the text already received to a fast model with
+a short "reformat this as valid JSON" prompt and the expected shape, and
+parses its answer with the stage's own parser; a ParseError from that parser
+is a "parse_error" event of the repair model. It makes at most `attempts`
+calls within `budget` seconds in all; when that runs out the stage goes on as
+it would have without it.
+
+Each repair ends in a "repair" event, fixed or unfixed, counted in
+botkit_repairs_total; an attempt that errors is a "failed" one. The calls
+are traced as stage "repair".
+
+    REPAIR_ATTEMPTS   calls per failed reply (default 2)
+    REPAIR_BUDGET     seconds for all of them (default 10)
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence, TypeVar, Union
+
+import fastapi_poe as fp
+
+from botkit import downstream, tracing
+from botkit.parsing import ParseError
+
+REPAIR_ATTEMPTS = int(os.environ.get("REPAIR_ATTEMPTS", "2"))
+REPAIR_BUDGET = float(os.environ.get("REPAIR_BUDGET", "10"))
+
+T = TypeVar("T")
+
+PROMPT = """Reformat the text below as valid JSON in this shape, inside a ```json \
+block. Keep the content as it is, do not add to it or translate it, and reply with \
+the JSON block only.
+
+Shape:
+{shape}
+
+Text:
+{text}"""
+
+
+@dataclass
+class Repair:
+    """Ask `model` to reformat a reply that failed to parse; `shape` is an example of
+    the JSON wanted"""
+
+    model: Union[str, Sequence[str]]
+    shape: str
+    attempts: int = REPAIR_ATTEMPTS
+    budget: float = REPAIR_BUDGET
+
+    async def run(
+        self, request: fp.QueryRequest, text: str, parse: Callable[[str], Optional[T]]
+    ) -> Optional[T]:
+        """parse() of a reformatted `text`, or None when no attempt within the budget
+        parsed; parse may raise ParseError"""
+        if not text.strip():
+            # nothing to reformat
+            return None
+        prompt = PROMPT.format(shape=self.shape, text=text)
+        message = fp.ProtocolMessage(role="user", content=prompt)
+        repair_request = request.model_copy(update={"query": [message]})
+
+        async def attempt(model: str) -> tuple[str, str]:
+            return (
+                await downstream.final_response(repair_request, model, "repair"),
+                model,
+            )
+
+        started = time.perf_counter()
+        deadline = started + self.budget
+        for i in range(self.attempts):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                fixed, model = await asyncio.wait_for(
+                    downstream.call_with_fallbacks(
+                        downstream.model_list(self.model), attempt, "repair"
+                    ),
+                    remaining,
+                )
+            except Exception as e:
+                tracing.event("repair", result="failed", attempt=i + 1, error=repr(e))
+                continue
+            try:
+                value = parse(fixed)
+            except ParseError as e:
+                tracing.event(
+                    "parse_error",
+                    stage="repair",
+                    model=model,
+                    reason=e.reason,
+                    text=tracing.preview(fixed),
+                )
+                value = None
+            if value:
+                tracing.event(
+                    "repair",
+                    result="fixed",
+                    attempt=i + 1,
+                    ms=round((time.perf_counter() - started) * 1000, 1),
+                )
+                return value
+        tracing.event(
+            "repair",
+            result="unfixed",
+            ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        return None
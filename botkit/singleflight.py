@@ -0,0 +1,48 @@
+"""
+
+Single-flight: concurrent identical calls share one execution.
+
+Text bots get the same short topic ("work", "monday") from many users within
+seconds. `shared(key, call, stage)` runs `call()` once per key at a time; every
+request that asks for the same key while it is in flight awaits the same
+result (or error) instead of starting its own downstream call. The call runs
+in its own task, so a caller that goes away does not cancel it for the others.
+Nothing is kept once the call is done; see botkit.cache for that.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+from botkit import tracing
+
+T = TypeVar("T")
+
+_in_flight: dict[str, asyncio.Task] = {}
+
+
+def normalize(text: str) -> str:
+    """The user's text as a key: case and spacing do not make a new request"""
+    return " ".join(text.split()).casefold()
+
+
+def _done(key: str, task: asyncio.Task) -> None:
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+    if not task.cancelled():
+        # retrieved here so an error nobody awaited any more is not logged as lost
+        task.exception()
+
+
+async def shared(key: str, call: Callable[[], Awaitable[T]], stage: str) -> T:
+    """Result of `call()`, shared with every concurrent caller of the same key"""
+    task = _in_flight.get(key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(call())
+        _in_flight[key] = task
+        task.add_done_callback(lambda done: _done(key, done))
+    else:
+        tracing.event("coalesced", stage=stage)
+    return await asyncio.shield(task)
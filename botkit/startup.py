@@ -0,0 +1,75 @@
+"""
+
+Container startup timing.
+
+Each phase is measured in seconds from process start and exported as
+botkit_startup_seconds{phase}, once per process:
+
+    imported        botkit is first imported; the bot files import
+                    fastapi_poe and modal before it, so this is mostly import time
+    app_ready       the FastAPI app is built (metrics.install)
+    first_request   the first request arrives, a user query or a warm-pool ping
+    first_response  the first request yields its first PartialResponse
+
+With a memory snapshot (botkit.deploy) the imports run once, before the
+snapshot, and a restored container starts in fastapi_app(). `imported` then is
+the import time of the snapshotted process, and metrics.install() calls
+restored() so the later phases count from the restore rather than from a
+process start that may be days old.
+
+The trigger of the first request is counted in botkit_cold_starts_total.
+
+"""
+
+from __future__ import annotations
+
+import os
+import time
+
+from botkit import deploy, metrics
+
+
+def _process_started() -> float:
+    """Wall clock time this process started, from /proc where there is one"""
+    try:
+        with open("/proc/self/stat") as f:
+            # fields after the command name; starttime is the 22nd field overall
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_STARTED = _process_started()
+# what phases are counted from, see restored()
+clock_started = PROCESS_STARTED
+phases: dict[str, float] = {}
+
+
+def mark(phase: str) -> None:
+    """Record the first time `phase` is reached in this process"""
+    if phase in phases:
+        return
+    phases[phase] = max(0.0, time.time() - clock_started)
+    metrics.startup_seconds.set(round(phases[phase], 3), phase=phase)
+
+
+def restored() -> None:
+    """Count the phases still to come from now, when running from a memory snapshot"""
+    global clock_started
+    if deploy.MEMORY_SNAPSHOT and "app_ready" not in phases:
+        clock_started = time.time()
+
+
+def first_request(trigger: str) -> bool:
+    """Note a request ("user" or "ping"); True for the first one in this process"""
+    if "first_request" in phases:
+        return False
+    mark("first_request")
+    metrics.cold_starts.inc(trigger=trigger)
+    return True
+
+
+mark("imported")
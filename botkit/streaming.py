@@ -0,0 +1,173 @@
+"""
+
+Pull "key": "value" fields out of an LLM reply while it is still streaming.
+
+The bots ask the LLM for a ```json block of string fields (often without the
+surrounding braces). FieldExtractor scans the streamed text once, keeps track of
+string and escape state across chunk boundaries, and calls back as soon as a
+field's value string is closed, so the next stage does not have to wait for
+the trailing tokens of the reply.
+
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Callable, Iterable, Optional
+
+import fastapi_poe as fp
+
+from botkit import downstream
+
+_SIMPLE_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "b": "\b",
+    "f": "\f",
+    "/": "/",
+    '"': '"',
+    "\\": "\\",
+}
+
+
+def decode_string(raw: str) -> str:
+    """Decode the body of a JSON string, tolerating raw newlines and bad escapes"""
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except ValueError:
+        pass
+    out = []
+    chars = iter(raw)
+    for ch in chars:
+        if ch != "\\":
+            out.append(ch)
+            continue
+        escaped = next(chars, "")
+        out.append(_SIMPLE_ESCAPES.get(escaped, escaped))
+    return "".join(out)
+
+
+class FieldExtractor:
+    """
+
+    Feed streamed text with `feed()`. `on_field(key, value)` fires for every
+    string field as soon as its value is closed, `on_object(fields)` fires when
+    a {...} object closes with the string fields collected inside it.
+    `fields` keeps the first value seen for each key.
+
+    """
+
+    def __init__(
+        self,
+        wanted: Optional[Iterable[str]] = None,
+        on_field: Optional[Callable[[str, str], None]] = None,
+        on_object: Optional[Callable[[dict], None]] = None,
+    ):
+        self.wanted = set(wanted) if wanted is not None else None
+        self.on_field = on_field
+        self.on_object = on_object
+        self.fields: dict[str, str] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything fed so far, e.g. when the bot replaces its response"""
+        self.fields.clear()
+        self._in_string = False
+        self._escaped = False
+        self._raw: list[str] = []
+        # the last closed string, while only whitespace followed it: a key if ':'
+        # comes next
+        self._key_candidate: Optional[str] = None
+        # set after "key": until the value starts
+        self._pending_key: Optional[str] = None
+        self._string_is_value = False
+        self._objects: list[dict[str, str]] = []
+
+    @property
+    def complete(self) -> bool:
+        """True once every wanted field has been seen"""
+        return self.wanted is not None and self.wanted.issubset(self.fields)
+
+    def feed(self, chunk: str) -> None:
+        for ch in chunk:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    self._raw.append(ch)
+                elif ch == "\\":
+                    self._escaped = True
+                    self._raw.append(ch)
+                elif ch == '"':
+                    self._close_string()
+                else:
+                    self._raw.append(ch)
+            elif ch == '"':
+                self._in_string = True
+                self._string_is_value = self._pending_key is not None
+                self._raw = []
+            elif ch.isspace():
+                continue
+            elif ch == ":" and self._key_candidate is not None:
+                self._pending_key = self._key_candidate
+                self._key_candidate = None
+            else:
+                # anything else (numbers, punctuation, prose) breaks a key/value pair
+                self._key_candidate = None
+                self._pending_key = None
+                if ch == "{":
+                    self._objects.append({})
+                elif ch == "}" and self._objects:
+                    obj = self._objects.pop()
+                    if obj and self.on_object is not None:
+                        self.on_object(obj)
+
+    def _close_string(self) -> None:
+        self._in_string = False
+        value = decode_string("".join(self._raw))
+        if not self._string_is_value:
+            self._key_candidate = value
+            return
+        key = self._pending_key
+        self._pending_key = None
+        if self._objects:
+            self._objects[-1].setdefault(key, value)
+        if self.wanted is not None and key not in self.wanted:
+            return
+        self.fields.setdefault(key, value)
+        if self.on_field is not None:
+            self.on_field(key, value)
+
+
+async def stream_fields(
+    request: fp.QueryRequest,
+    bot_name: str,
+    fields: Iterable[str],
+    on_field: Optional[Callable[[str, str], None]] = None,
+    stage: str = "llm",
+) -> tuple[dict[str, str], str]:
+    """
+
+    Stream the reply of `bot_name` and return (fields, text received so far) as
+    soon as all `fields` are complete, closing the stream without waiting for
+    the rest of the reply. Missing fields are absent from the returned dict,
+    see parsing.require_fields. The call is traced as `stage`.
+
+    """
+    extractor = FieldExtractor(fields, on_field)
+    chunks: list[str] = []
+    stream = downstream.stream(request, bot_name, stage)
+    try:
+        async for msg in stream:
+            if isinstance(msg, fp.MetaResponse) or msg.is_suggested_reply:
+                continue
+            if msg.is_replace_response:
+                chunks.clear()
+                extractor.reset()
+            chunks.append(msg.text)
+            extractor.feed(msg.text)
+            if extractor.complete:
+                break
+    finally:
+        await stream.aclose()
+    return extractor.fields, "".join(chunks)
@@ -0,0 +1,226 @@
+"""
+
+Per-request tracing that stays off the request path.
+
+Each bot request gets a trace; each downstream call, parse or other stage is a
+span with its timing, model, payload sizes and outcome. Every span and event
+also feeds botkit.metrics, sampled or not. Finished spans are
+put on a bounded asyncio queue and written to stdout as JSON lines by a
+background task, in batches and from an executor thread, so a slow log sink
+never blocks the event loop. When the queue is full, records are dropped and
+counted rather than waited on.
+
+    TRACE_SAMPLE_RATE   fraction of requests whose spans are written (default 1.0)
+    TRACE_MAX_CHARS     prompt/response previews are cut to this length
+                        (default 300, 0 = off)
+    TRACE_QUEUE_SIZE    records buffered before dropping (default 10000)
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, AsyncIterable, Optional
+
+from botkit import metrics, startup
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_MAX_CHARS = int(os.environ.get("TRACE_MAX_CHARS", "300"))
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", "10000"))
+FLUSH_BATCH = 200
+
+
+class Trace:
+    def __init__(self, bot: str, trace_id: str, sampled: bool):
+        self.bot = bot
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.started = time.perf_counter()
+
+    def offset_ms(self, at: float) -> float:
+        return round((at - self.started) * 1000, 1)
+
+
+class Span:
+    def __init__(self, name: str, attrs: dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.outcome = "ok"
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("botkit_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def preview(text: Optional[str]) -> Optional[str]:
+    """Cut payloads down to TRACE_MAX_CHARS for the trace records"""
+    if text is None or TRACE_MAX_CHARS <= 0:
+        return None
+    return text if len(text) <= TRACE_MAX_CHARS else text[:TRACE_MAX_CHARS] + "..."
+
+
+class _Exporter:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.dropped = 0
+        # where JSON lines go; None means sys.stdout at write time
+        self.output = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def emit(self, record: dict[str, Any]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # outside the event loop (startup code, scripts): nothing to block
+            self._write([record])
+            return
+        if self._loop is not loop:
+            # the queue and flush task belong to one loop
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._task = loop.create_task(self._flush_forever())
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.trace_records_dropped.inc()
+
+    async def _flush_forever(self) -> None:
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < FLUSH_BATCH and not queue.empty():
+                batch.append(queue.get_nowait())
+            if self.dropped:
+                batch.append({"type": "dropped", "records": self.dropped})
+                self.dropped = 0
+            await loop.run_in_executor(None, self._write, batch)
+
+    def _write(self, records: list[dict[str, Any]]) -> None:
+        output = self.output or sys.stdout
+        output.write(
+            "".join(
+                json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records
+            )
+        )
+        output.flush()
+
+
+exporter = _Exporter(TRACE_QUEUE_SIZE)
+
+
+def event(name: str, **attrs: Any) -> None:
+    """Record a point-in-time event in the current trace"""
+    trace = current_trace()
+    metrics.record_event(trace.bot if trace else None, name, attrs)
+    if trace is not None and not trace.sampled:
+        return
+    record = {"type": "event", "name": name, **attrs}
+    if trace is not None:
+        record.update(
+            trace=trace.trace_id,
+            bot=trace.bot,
+            at_ms=trace.offset_ms(time.perf_counter()),
+        )
+    exporter.emit(record)
+
+
+def _finish(span: Span) -> None:
+    span.duration = time.perf_counter() - span.started
+    trace = current_trace()
+    metrics.record_span(
+        trace.bot if trace else None, span.name, span.duration, span.outcome, span.attrs
+    )
+    if trace is None or not trace.sampled:
+        return
+    exporter.emit(
+        {
+            "type": "span",
+            "trace": trace.trace_id,
+            "bot": trace.bot,
+            "span": span.name,
+            "start_ms": trace.offset_ms(span.started),
+            "duration_ms": round(span.duration * 1000, 1),
+            "outcome": span.outcome,
+            **span.attrs,
+        }
+    )
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs: Any):
+    """Time a stage of the current request; the span records how it ended"""
+    current = Span(name, attrs)
+    try:
+        yield current
+    except GeneratorExit:
+        # the consumer stopped reading early, e.g. once it had all it needed
+        current.outcome = "closed"
+        raise
+    except asyncio.CancelledError:
+        current.outcome = "cancelled"
+        raise
+    except BaseException as e:
+        current.outcome = "error"
+        current.set(error=repr(e))
+        raise
+    finally:
+        _finish(current)
+
+
+async def trace_request(bot: str, request, responses: AsyncGenerator) -> AsyncIterable:
+    """
+
+    Pass a bot's responses through while tracing the request: opens the trace
+    and records a "request" span with time to first yield, number of yields
+    and text size.
+
+    """
+    trace = Trace(
+        bot, request.message_id or uuid.uuid4().hex, random.random() < TRACE_SAMPLE_RATE
+    )
+    token = _current_trace.set(trace)
+    startup.first_request("user")
+    metrics.requests_in_flight.inc(bot=bot)
+    try:
+        with span(
+            "request", user=request.user_id, conversation=request.conversation_id
+        ) as request_span:
+            yields = 0
+            chars = 0
+            async for response in responses:
+                if yields == 0:
+                    request_span.set(
+                        first_yield_ms=trace.offset_ms(time.perf_counter())
+                    )
+                    startup.mark("first_response")
+                yields += 1
+                chars += len(response.text)
+                yield response
+            request_span.set(yields=yields, response_chars=chars)
+    finally:
+        # closing early (client gone) must also stop the bot's generator
+        await responses.aclose()
+        metrics.requests_in_flight.dec(bot=bot)
+        # a generator finalized by the loop runs in another context
+        with contextlib.suppress(ValueError):
+            _current_trace.reset(token)
@@ -0,0 +1,81 @@
+"""
+
+Image description through a vision LLM, cached by attachment content.
+
+Users often upload the same photo again to try another style or another bot.
+The extracted image prompt is cached under the hash of the attachment bytes,
+the description prompt and the vision model, so a repeat upload skips the
+vision call. Any change to a bot's description prompt changes the key.
+
+Set VISION_CACHE_DIR (e.g. a Modal Volume path) to keep entries on disk too.
+
+On a miss the photo is shrunk before the vision call, see botkit.imageprep.
+
+"""
+
+from __future__ import annotations
+
+import os
+import time
+
+import fastapi_poe as fp
+
+from botkit import imageprep, metrics, tracing
+from botkit.attachments import content_hash, fetch
+from botkit.cache import DiskCache, LayeredCache, TTLCache, make_key
+from botkit.parsing import require_fields
+from botkit.streaming import stream_fields
+
+VISION_CACHE_SIZE = int(os.environ.get("VISION_CACHE_SIZE", "2048"))
+VISION_CACHE_TTL = float(os.environ.get("VISION_CACHE_TTL", str(7 * 24 * 3600)))
+VISION_CACHE_DIR = os.environ.get("VISION_CACHE_DIR")
+
+description_cache = LayeredCache(
+    TTLCache(max_entries=VISION_CACHE_SIZE, ttl=VISION_CACHE_TTL),
+    DiskCache(VISION_CACHE_DIR, ttl=VISION_CACHE_TTL) if VISION_CACHE_DIR else None,
+)
+
+
+async def describe_image(
+    request: fp.QueryRequest,
+    bot_name: str,
+    field: str = "image_prompt",
+    preprocess: bool = True,
+) -> str:
+    """
+
+    Send the last message (description prompt + image attachment) to the vision
+    model and return `field` from its reply, using the cache when possible.
+    Raises parsing.ParseError when the reply has no `field`.
+
+    """
+    message = request.query[-1]
+    image_bytes = None
+    try:
+        photo = await fetch(message.attachments[0].url)
+        image_bytes, digest = photo.data, photo.digest
+        key = make_key(digest, content_hash(message.content.encode("utf-8")), bot_name)
+    except Exception as e:
+        # the cache is best effort, fall back to a plain vision call
+        tracing.event("vision_cache", result="disabled", error=repr(e))
+        key = None
+
+    if key is not None:
+        image_prompt = await description_cache.get(key)
+        if image_prompt is not None:
+            tracing.event("vision_cache", result="hit", model=bot_name)
+            return image_prompt
+        tracing.event("vision_cache", result="miss", model=bot_name)
+
+    sent = request
+    if preprocess and key is not None:
+        sent = await imageprep.prepared(request, image_bytes, digest)
+    started = time.perf_counter()
+    fields, text = await stream_fields(sent, bot_name, (field,), stage="vision")
+    metrics.vision_seconds.observe(
+        time.perf_counter() - started, preprocessed=str(sent is not request).lower()
+    )
+    image_prompt = require_fields(fields, text, (field,), bot_name, "vision")[field]
+    if key is not None:
+        await description_cache.set(key, image_prompt)
+    return image_prompt
@@ -0,0 +1,184 @@
+"""
+
+Warm pool for bots with bursty traffic.
+
+A bot app that scales to zero makes its first user wait for a cold start plus
+the TLS handshakes to Poe. An app opts in by scheduling `tick(fastapi_app)`
+every WARM_PING_MINUTES:
+
+    @app.function(image=image, secrets=[...same as fastapi_app...],
+                  schedule=modal.Period(minutes=warmpool.WARM_PING_MINUTES))
+    def keep_warm():
+        warmpool.tick(fastapi_app)
+
+The function needs the web function's secrets, the policy is read from them.
+Each tick sets the web function's min_containers from the policy below and,
+while that is above zero, pings its GET /warm endpoint (added by `install`),
+which opens connections to Poe from the web container. A container whose first
+request was the ping absorbed a cold start no user had to wait for; both kinds
+are counted in
+botkit_cold_starts_total{trigger}, and the ticks print the container-seconds
+the policy keeps warm, so avoided cold starts can be weighed against idle cost.
+benchmarks/warm_pool.py runs the same comparison offline on an arrival trace.
+With neither WARM_MIN_CONTAINERS nor WARM_SCHEDULE set, ticks leave the
+autoscaler alone, so the KEEP_WARM set at deploy time (botkit.deploy) stands.
+
+    WARM_MIN_CONTAINERS   containers kept outside the schedule (default KEEP_WARM)
+    WARM_SCHEDULE         windows and containers kept in them, e.g.
+                          "08:00-23:00=1,12:00-14:00=2" (a window may cross midnight)
+    WARM_TIMEZONE         timezone of the schedule (default UTC)
+    WARM_PING_MINUTES     tick period (default 5)
+    WARM_HOSTS            hosts the ping connects to (default https://api.poe.com)
+
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, time as day_time
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import httpx
+
+from botkit import deploy, httpclient, metrics, startup
+
+# None: not set, see WarmPolicy.configured
+WARM_MIN_CONTAINERS = os.environ.get("WARM_MIN_CONTAINERS")
+WARM_SCHEDULE = os.environ.get("WARM_SCHEDULE", "")
+WARM_TIMEZONE = os.environ.get("WARM_TIMEZONE", "UTC")
+WARM_PING_MINUTES = int(os.environ.get("WARM_PING_MINUTES", "5"))
+WARM_HOSTS = [
+    host
+    for host in os.environ.get("WARM_HOSTS", "https://api.poe.com").split(",")
+    if host
+]
+PING_TIMEOUT = 10
+
+
+@dataclass
+class Window:
+    start: day_time
+    end: day_time
+    containers: int
+
+    def contains(self, at: day_time) -> bool:
+        if self.start <= self.end:
+            return self.start <= at < self.end
+        # crosses midnight
+        return at >= self.start or at < self.end
+
+
+def parse_schedule(text: str) -> list[Window]:
+    """ "08:00-23:00=1,12:00-14:00=2" -> windows; raises ValueError on bad input"""
+    windows = []
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        span, containers = part.split("=")
+        start, end = span.split("-")
+        # "24:00" ends a window at midnight
+        end = "00:00" if end.strip() == "24:00" else end
+        windows.append(
+            Window(
+                day_time.fromisoformat(start),
+                day_time.fromisoformat(end),
+                int(containers),
+            )
+        )
+    return windows
+
+
+@dataclass
+class WarmPolicy:
+    min_containers: int = 0
+    windows: tuple[Window, ...] = ()
+    timezone: str = "UTC"
+    # False when nothing was set: tick() then leaves the autoscaler alone
+    configured: bool = True
+
+    @classmethod
+    def from_env(cls) -> WarmPolicy:
+        min_containers = (
+            deploy.KEEP_WARM
+            if WARM_MIN_CONTAINERS is None
+            else int(WARM_MIN_CONTAINERS)
+        )
+        configured = WARM_MIN_CONTAINERS is not None or bool(WARM_SCHEDULE.strip())
+        return cls(
+            min_containers,
+            tuple(parse_schedule(WARM_SCHEDULE)),
+            WARM_TIMEZONE,
+            configured,
+        )
+
+    def containers_at(self, when: Optional[datetime] = None) -> int:
+        """Containers to keep warm at `when` (default now): the largest window there"""
+        local = (
+            (when or datetime.now(ZoneInfo("UTC")))
+            .astimezone(ZoneInfo(self.timezone))
+            .time()
+        )
+        return max(
+            [self.min_containers]
+            + [w.containers for w in self.windows if w.contains(local)]
+        )
+
+
+policy = WarmPolicy.from_env()
+
+
+async def warm_connections() -> dict[str, Optional[float]]:
+    """Open pooled connections to WARM_HOSTS; seconds per host, None on failure"""
+    timings: dict[str, Optional[float]] = {}
+    for host in WARM_HOSTS:
+        started = time.perf_counter()
+        try:
+            # through the shared client, so the connection stays in the pool for
+            # the next user
+            await httpclient.client().head(host, timeout=PING_TIMEOUT)
+            timings[host] = round(time.perf_counter() - started, 4)
+        except httpx.HTTPError:
+            timings[host] = None
+    return timings
+
+
+def install(app) -> None:
+    """Add GET /warm to a bot's FastAPI app, for tick()"""
+
+    @app.get("/warm", include_in_schema=False)
+    async def warm() -> dict:
+        metrics.warm_pings.inc()
+        cold = startup.first_request("ping")
+        return {"cold": cold, "connections": await warm_connections()}
+
+
+def tick(web_function, when: Optional[datetime] = None) -> dict:
+    """Apply the policy to a Modal web function and ping it; run on a schedule"""
+    if not policy.configured:
+        # the autoscaler keeps what the deploy set
+        report = {"warm_pool": web_function.object_id, "policy": None}
+        print(json.dumps(report))
+        return report
+    containers = policy.containers_at(when)
+    web_function.update_autoscaler(min_containers=containers)
+    report = {
+        "warm_pool": web_function.object_id,
+        "min_containers": containers,
+        "idle_container_seconds": containers * WARM_PING_MINUTES * 60,
+    }
+    if containers == 0:
+        # outside the schedule: a ping would start a container nobody asked for
+        print(json.dumps(report))
+        return report
+    try:
+        response = httpx.get(
+            web_function.get_web_url().rstrip("/") + "/warm", timeout=60
+        )
+        response.raise_for_status()
+        report.update(response.json())
+    except httpx.HTTPError as e:
+        report["error"] = repr(e)
+    print(json.dumps(report))
+    return report
@@ -8,30 +8,23 @@ Using a LLM and a text2img model.
 
 from __future__ import annotations
 
-from typing import AsyncIterable
-import asyncio
 import fastapi_poe as fp
-from modal import Image, App, asgi_app
+from modal import App, asgi_app
 import modal
-import time
-import re
 import os
 
+from botkit import deploy, metrics
+from botkit.pipeline import Extract, Pipeline, PipelineBot, Render
+
 # Define 2 models for LLM and image model, can be changed with any POE bots
 LLM_MODEL = "GPT-4o"
 IMAGE_MODEL = "Ideogram"
 
-class MemesCreatorBot(fp.PoeBot):
-    async def get_response(
-        self, request: fp.QueryRequest
-    ) -> AsyncIterable[fp.PartialResponse]:
-
-        last_message = request.query[-1].content
-        print(f'Last Messaging: {last_message}')
 
-        # Query LLM for creating memes
-        prompt = f"""1. You are comedia good at sarcasm and jokes with deep thoughs.
-        2. Create 10 humour and sarcasm and deep joke meme about {last_message}.
+def llm_prompt(ctx):
+    # Query LLM for creating memes
+    return f"""1. You are comedia good at sarcasm and jokes with deep thoughs.
+        2. Create 10 humour and sarcasm and deep joke meme about {ctx.text}.
         3. Read thru all the memes and pick one of the best meme.
         4. Print the one final meme in below json format.
 
@@ -40,57 +33,38 @@ class MemesCreatorBot(fp.PoeBot):
         "caption": " "
         \`\`\`"""
 
-        print(f'Prompt: {prompt}')
-        request.query = [fp.ProtocolMessage(role="user", content=prompt)]
 
-        # Query LLM for creating memes
-        final_meme = await fp.get_final_response(request, bot_name=LLM_MODEL, api_key=request.access_key)
-        print(final_meme)
+def compose_image_prompt(ctx, fields):
+    # Query Image Model for creating image
+    image_prompt = fields["image_prompt"]
+    return f"An amusingly exaggerated cartoon of {image_prompt}, The overall tone of the image is playful and humorous, capturing the essence of impatience in a sarcastic and lighthearted way."
 
-        image_prompt = self.extract_image_prompt(final_meme)
-        caption = self.extract_caption_prompt(final_meme)
-        print(f'Image Prompt: {image_prompt}')
-        print(f'Caption: {caption}')
 
-        yield fp.PartialResponse(text=f'"{caption}"\n\n')
+def caption(ctx):
+    # the caption is shown while the image is being drawn
+    return f'"{ctx.fields["caption"]}"\n\n'
 
-        # Query Image Model for creating image
-        request.query = [fp.ProtocolMessage(role="user", content=f"An amusingly exaggerated cartoon of {image_prompt}, The overall tone of the image is playful and humorous, capturing the essence of impatience in a sarcastic and lighthearted way.")]
-        image_response = await fp.get_final_response(request, bot_name=IMAGE_MODEL, api_key=request.access_key)
-        print(f'Image Response: {image_response}')
 
-        yield fp.PartialResponse(text=f'"{caption}"\n\n{image_response}')
+class MemesCreatorBot(PipelineBot):
+    pipeline = Pipeline(
+        "memes-creator",
+        # the same topic from many users at once shares one LLM call, each still gets its own image
+        extract=Extract(LLM_MODEL, llm_prompt, ("image_prompt", "caption"), attachments=False, coalesce=True),
+        preview=caption,
+        compose=compose_image_prompt,
+        render=Render(IMAGE_MODEL),
+    )
 
     async def get_settings(self, setting: fp.SettingsRequest) -> fp.SettingsResponse:
         return fp.SettingsResponse(server_bot_dependencies={LLM_MODEL: 1, IMAGE_MODEL: 1}, 
                                    introduction_message="Welcome to the Memes-Creator running by @xiaowenzhang. Please provide me a topic that you would like me create a meme about. E.g:work...\n - Update 20240602: Reduced cost by using GPT-4o, have fun!\n - Update 20240710: Use Ideogram for best quality")
-    
-    # Read the JSON string and extract the image_prompt and caption. Poe does not support JSON object call on GPT3.5/4
-    def extract_image_prompt(self, long_string):
-    # 定义正则表达式模式
-        pattern = r'"image_prompt": "(.*?)"'
-        
-        # 使用re.search查找第一个匹配项
-        match = re.search(pattern, long_string)
-        
-        # 如果找到匹配项，返回匹配的内容，否则返回"ERROR"
-        return match.group(1) if match else "ERROR"
-    def extract_caption_prompt(self, long_string):
-    # 定义正则表达式模式
-        pattern = r'"caption": "(.*?)"'
-        
-        # 使用re.search查找第一个匹配项
-        match = re.search(pattern, long_string)
-        
-        # 如果找到匹配项，返回匹配的内容，否则返回"ERROR"
-        return match.group(1) if match else "ERROR"
-
-REQUIREMENTS = ["fastapi-poe==0.0.44"] # latest 0.0.34
-image = Image.debian_slim().pip_install(*REQUIREMENTS)
+
+
+image = deploy.base_image()
 app = App("memes-creator-poe")
 
 
-@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()])
+@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()], **deploy.container_options())
 @asgi_app()
 def fastapi_app():
     bot = MemesCreatorBot()
@@ -105,4 +79,5 @@ def fastapi_app():
 
     #app = fp.make_app(bot, allow_without_key=True)
     app = fp.make_app(bot, access_key=os.environ["MEME_BOT_KEY"])
+    metrics.install(app)
     return app
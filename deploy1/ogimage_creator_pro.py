@@ -8,37 +8,26 @@ Using a LLM and a text2img model.
 
 from __future__ import annotations
 
-from typing import AsyncIterable
-import asyncio
 import fastapi_poe as fp
-from modal import Image, App, asgi_app
+from modal import App, asgi_app
 import modal
-import time
-import re
 import os
 
+from botkit import deploy, metrics
+from botkit.pipeline import Extract, Pipeline, PipelineBot, Render
+
 # Define 2 models for LLM and image model, can be changed with any POE bots
 LLM_MODEL = "Claude-3.5-Haiku"
 IMAGE_MODEL = "Playground-v3"
 
-class OgImageCreatorBot(fp.PoeBot):
-    async def get_response(
-        self, request: fp.QueryRequest
-    ) -> AsyncIterable[fp.PartialResponse]:
-        try:
-            # remove content, only use the latest 1 query.
-            request.query = [request.query[-1]]
-            # pick the one last message
-            message = request.query[-1]
-            # save original user message
-            original_content = message.content
-
-            # prompt to vision model and describe the image
-            # if any key infor missed from the converted image, this prompt can be used to optimize
-            # current GPT4 on poe doesnot support this prompt.
-            message.content = f"""Based on information user provide, design the best og image for this content and describe as prompt in english, the image is simple and not contain any words:
+
+def llm_prompt(ctx):
+    # prompt to vision model and describe the image
+    # if any key infor missed from the converted image, this prompt can be used to optimize
+    # current GPT4 on poe doesnot support this prompt.
+    return f"""Based on information user provide, design the best og image for this content and describe as prompt in english, the image is simple and not contain any words:
             ---
-            {original_content}
+            {ctx.text}
             ---
 
             prompt in less than 30 words:
@@ -46,44 +35,33 @@ class OgImageCreatorBot(fp.PoeBot):
                 \`\`\`json
                 "image_prompt": ""
                 \`\`\`"""
-            # the prompt for remix image
-            final_vision_prompt = await fp.get_final_response(request, bot_name=LLM_MODEL, api_key=request.access_key)
-            print(final_vision_prompt)
-            image_prompt = self.extract_image_prompt(final_vision_prompt)
-            
-
-            message.content = f"{image_prompt}, in the style of colorful, creative, illustrations, innovative page design, flat minimalist, vector --aspect 16:9"
-            print(f'Prompt: {message.content}')
-            image_response = await fp.get_final_response(request, bot_name=IMAGE_MODEL, api_key=request.access_key)
-            print(message.content)
-            print(image_response)
-            yield fp.PartialResponse(text=f'{image_response}')
-        except:
-            yield fp.PartialResponse(text="Something went wrong. Please try again or contact the admin.")
-            return
+
+
+def compose_image_prompt(ctx, fields):
+    image_prompt = fields.get("image_prompt", "ERROR")
+    return f"{image_prompt}, in the style of colorful, creative, illustrations, innovative page design, flat minimalist, vector --aspect 16:9"
+
+
+class OgImageCreatorBot(PipelineBot):
+    pipeline = Pipeline(
+        "ogimage-pro",
+        # the same topic from many users at once shares one LLM call, each still gets its own image
+        extract=Extract(LLM_MODEL, llm_prompt, ("image_prompt",), coalesce=True),
+        compose=compose_image_prompt,
+        render=Render(IMAGE_MODEL),
+    )
+
     async def get_settings(self, setting: fp.SettingsRequest) -> fp.SettingsResponse:
         return fp.SettingsResponse(server_bot_dependencies={LLM_MODEL: 1, IMAGE_MODEL: 1}, 
                                    introduction_message="Welcome to the OG Image Creator Bot Pro running by @xiaowenzhang. Please provide content or even a full article for me to create a OG image for your publications. \n\n**Update 20241109:**\n\n - Change to Claude-3.5-Haiku + Playground-v3\n\n**Click Upvote to Support my work!**",
                                    allow_attachments=True)
-    
-    # Read the JSON string and extract the image_prompt and caption. Poe does not support JSON object call on GPT3.5/4
-    def extract_image_prompt(self, long_string):
-    # 定义正则表达式模式
-        pattern = r'"image_prompt": "(.*?)"'
-        
-        # 使用re.search查找第一个匹配项
-        match = re.search(pattern, long_string)
-        
-        # 如果找到匹配项，返回匹配的内容，否则返回"ERROR"
-        return match.group(1) if match else "ERROR"
-
-
-REQUIREMENTS = ["fastapi-poe==0.0.44"] # latest 0.0.34
-image = Image.debian_slim().pip_install(*REQUIREMENTS)
+
+
+image = deploy.base_image()
 app = App("ogimage-pro-poe")
 
 
-@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()])
+@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()], **deploy.container_options())
 @asgi_app()
 def fastapi_app():
     bot = OgImageCreatorBot()
@@ -96,9 +74,9 @@ def fastapi_app():
     # POE_ACCESS_KEY = ""
     print('api started...')
     key = os.environ["OG_IMAGE_PRO_BOT_KEY"]
-    print(f"Key:{key}")
     #app = fp.make_app(bot, allow_without_key=True)
     app = fp.make_app(bot, access_key=key)
 
     #app = fp.make_app(bot, access_key=os.environ["OG_IMAGE_PRO_BOT_KEY"])
+    metrics.install(app)
     return app
@@ -8,39 +8,27 @@ Using a LLM and a text2img model.
 
 from __future__ import annotations
 
-from typing import AsyncIterable
-import asyncio
 import fastapi_poe as fp
-from modal import Image, App, asgi_app
+from modal import App, asgi_app
 import modal
-import time
-import re
 import os
 
+from botkit import deploy, metrics
+from botkit.pipeline import Extract, Pipeline, PipelineBot, Render
+
 # Define 2 models for LLM and image model, can be changed with any POE bots
 LLM_MODEL = "Gemini-2.5-Flash-Preview"
 IMAGE_MODEL = "Ideogram-v3"
 
-class OgImageCreatorBot(fp.PoeBot):
-    async def get_response(
-        self, request: fp.QueryRequest
-    ) -> AsyncIterable[fp.PartialResponse]:
-        print('Started Processing...')
-        try:
-            # remove content, only use the latest 1 query.
-            request.query = [request.query[-1]]
-            # pick the one last message
-            message = request.query[-1]
-            # save original user message
-            original_content = message.content
-
-            # prompt to vision model and describe the image
-            # if any key infor missed from the converted image, this prompt can be used to optimize
-            # current GPT4 on poe doesnot support this prompt.
-            message.content = f"""Based on the content user provide, create a story for 4 panels of comic in less than 10 words for each panel. 
+
+def llm_prompt(ctx):
+    # prompt to vision model and describe the image
+    # if any key infor missed from the converted image, this prompt can be used to optimize
+    # current GPT4 on poe doesnot support this prompt.
+    return f"""Based on the content user provide, create a story for 4 panels of comic in less than 10 words for each panel. 
 
 \`\`\`content
-{original_content}
+{ctx.text}
 \`\`\`
 
 steps:
@@ -57,62 +45,38 @@ steps:
 "panel3_prompt":"",
 "panel4_prompt":""
 \`\`\`"""
-            print('Prompt: \n', message.content)
-            # the prompt for remix image
-            response_string = await fp.get_final_response(request, bot_name=LLM_MODEL, api_key=request.access_key)
-            print(response_string)
-            
-            # extract the story and 4 prompts
-            story_line = self.extract_image_prompt(response_string, "story_line")
-            panel1_prompt = self.extract_image_prompt(response_string, "panel1_prompt")
-            panel2_prompt = self.extract_image_prompt(response_string, "panel2_prompt")
-            panel3_prompt = self.extract_image_prompt(response_string, "panel3_prompt")
-            panel4_prompt = self.extract_image_prompt(response_string, "panel4_prompt")
-
-            # final prompt
-            message.content = f"generate a four panel comic. Below panels in order.: \n1.{panel1_prompt} \n2.{panel2_prompt} \n3.{panel3_prompt} \n4.{panel4_prompt}"
-            print(f'Image Prompt: \n{message.content}')
-            sent_files = []
-            async for msg in fp.stream_request(
-                        request, IMAGE_MODEL, request.access_key
-            ):
-                # Add whatever logic you'd like to handle text responses from the Bot
-                pass
-                # If there is an attachment, add it to the list of sent files
-                if msg.attachment:
-                    print(f'图像响应:', msg.attachment)
-                    sent_files.append(msg.attachment)
-
-            for file in sent_files:
-                yield fp.PartialResponse(text=f"![image]({file.url})\n\n")
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            yield fp.PartialResponse(text=f"Something went wrong. Please try again or contact the admin.")
-            return
+
+
+def compose_image_prompt(ctx, fields):
+    # extract the 4 prompts; story_line only helps the LLM keep the panels together
+    panel1_prompt = fields["panel1_prompt"]
+    panel2_prompt = fields["panel2_prompt"]
+    panel3_prompt = fields["panel3_prompt"]
+    panel4_prompt = fields["panel4_prompt"]
+    # final prompt
+    return f"generate a four panel comic. Below panels in order.: \n1.{panel1_prompt} \n2.{panel2_prompt} \n3.{panel3_prompt} \n4.{panel4_prompt}"
+
+
+class OgImageCreatorBot(PipelineBot):
+    pipeline = Pipeline(
+        "fourpanelcomics-pro",
+        # the same topic from many users at once shares one LLM call, each still gets its own image
+        extract=Extract(LLM_MODEL, llm_prompt, ("panel1_prompt", "panel2_prompt", "panel3_prompt", "panel4_prompt"), coalesce=True),
+        compose=compose_image_prompt,
+        render=Render(IMAGE_MODEL),
+    )
+
     async def get_settings(self, setting: fp.SettingsRequest) -> fp.SettingsResponse:
         return fp.SettingsResponse(server_bot_dependencies={LLM_MODEL: 1, IMAGE_MODEL: 1}, 
                                    introduction_message="Welcome to 4PanelComics Pro running by @xiaowenzhang. Please provide content or even a full article for me to create a 4 Panel Comics for you. \n\n**Click Upvote to Support my work!**",
                                    allow_attachments=True)
-    
-    # Read the JSON string and extract the image_prompt and caption. Poe does not support JSON object call on GPT3.5/4
-    def extract_image_prompt(self, json_string, tag):
-    # 定义正则表达式模式
-        pattern = rf'"{tag}": "(.*?)"'
-        
-        # 使用re.search查找第一个匹配项
-        match = re.search(pattern, json_string)
-        
-        # 如果找到匹配项，返回匹配的内容，否则返回"ERROR"
-        return match.group(1) if match else "ERROR"
-
-
-REQUIREMENTS = ["fastapi-poe==0.0.44"] # latest 0.0.34
-image = Image.debian_slim().pip_install(*REQUIREMENTS)
+
+
+image = deploy.base_image()
 app = App("fourpanelcomics-pro-poe")
 
 
-@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()])
+@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()], **deploy.container_options())
 @asgi_app()
 def fastapi_app():
     bot = OgImageCreatorBot()
@@ -127,4 +91,5 @@ def fastapi_app():
 
     #app = fp.make_app(bot, allow_without_key=True)
     app = fp.make_app(bot, access_key=os.environ["FOURPANEL_BOT_KEY"])
+    metrics.install(app)
     return app
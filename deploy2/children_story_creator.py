@@ -9,35 +9,42 @@
 
 from __future__ import annotations
 
-from typing import AsyncIterable
 import asyncio
+
 import fastapi_poe as fp
-from modal import Image, App, asgi_app
+from modal import App, asgi_app
 import modal
-import time
-import re
 import os
-import json
+
+from botkit import deploy, metrics, parsing
+from botkit.pipeline import ExtractItems, Pipeline, PipelineBot, Render
+from botkit.repair import Repair
 
 # 定义 LLM 和图像模型，可以根据需要更换为其他 POE 机器人
 LLM_MODEL = "Gemini-2.5-Pro-Preview"
 IMAGE_MODEL = "Imagen-3-Fast"
-
-class ChildrenStoryCreatorBot(fp.PoeBot):
-    async def get_response(
-        self, request: fp.QueryRequest
-    ) -> AsyncIterable[fp.PartialResponse]:
-        print('开始处理儿童绘本故事创作请求...')
-        try:
-            # 只使用最新的一条查询
-            request.query = [request.query[-1]]
-            message = request.query[-1]
-            original_content = message.content
-
-            # 第一步：调用 LLM 创作四段式儿童绘本故事
-            story_prompt = f"""请根据用户的要求创作一个适合儿童的绘本短篇故事。            
-
-用户要求：[{original_content}]
+# 主模型出错或超时后依次尝试的备用模型
+LLM_FALLBACK_MODEL = "Gemini-2.5-Flash-Preview"
+IMAGE_FALLBACK_MODEL = "Playground-v3"
+# 单张配图超过该秒数仍未返回时，同时向备用模型发起请求，先返回者胜出
+IMAGE_HEDGE_AFTER = 12
+# 等待故事 LLM 写出第一段的最长时间（秒），超时后改用备用模型重新生成；
+# 第一段之后只在输出停顿超过该秒数时结束，已写出的段落照常配图
+LLM_ATTEMPT_TIMEOUT = 45
+# 故事 JSON 解析失败时，由该快速模型把已生成的内容整理成合法 JSON，而不是重新生成整个故事
+REPAIR_MODEL = "Claude-3-Haiku"
+# 整理的最多次数和总耗时上限（秒）
+REPAIR_ATTEMPTS = 2
+REPAIR_BUDGET = 15
+# 同时生成配图的最大数量，需不超过 get_settings 中声明的 IMAGE_MODEL 调用次数
+IMAGE_CONCURRENCY = 4
+
+
+def story_prompt(ctx):
+    # 调用 LLM 创作四段式儿童绘本故事
+    return f"""请根据用户的要求创作一个适合儿童的绘本短篇故事。            
+
+用户要求：[{ctx.text}]
 
 首先，判断用户要求使用的语言，并使用同样的语种写故事。这是最重要的需求，你必须遵守！
 
@@ -73,120 +80,105 @@ class ChildrenStoryCreatorBot(fp.PoeBot):
 - 每段文字控制在200字
 - 英文提示词要详细描述画面，包含角色、场景、动作、情感等，主角需要保持外观一致性
 - 画风要适合儿童绘本，温馨可爱"""
-            
-            message.content = story_prompt
-            print('LLM 提示词: \n', message.content)
-            
-            # 获取 LLM 生成的故事内容
-            story_response = await fp.get_final_response(request, bot_name=LLM_MODEL, api_key=request.access_key)
-            print('LLM 响应:', story_response)
-            
-            # 解析故事 JSON
-            story_data = self.extract_story_json(story_response)
-            if not story_data:
-                yield fp.PartialResponse(text="Sorry, failed to generate story.")
-                return
-            
-            yield fp.PartialResponse(text="🎨 **Creating a new story for you...** \n\n")
-            
-            # 第二步：遍历每个故事段落，生成文本和图片
-            for i, segment in enumerate(story_data, 1):
-                story_text = segment.get('story_text', '')
-                image_prompt = segment.get('image_prompt', '')
-                
-                # 2.1 渲染故事文本到客户端
-                yield fp.PartialResponse(text=f"**Section {i}：**\n{story_text}\n\n")
-                
-                # 2.2 生成配图
-                if image_prompt:
-                    # 优化图像提示词，添加儿童绘本风格
-                    enhanced_prompt = f"""{image_prompt}
+
+
+# 整理 JSON 时给出的目标格式
+STORY_SHAPE = """[
+  {"story_text": "...", "image_prompt": "..."},
+  {"story_text": "...", "image_prompt": "..."},
+  {"story_text": "...", "image_prompt": "..."},
+  {"story_text": "...", "image_prompt": "..."}
+]"""
+
+
+def compose_image_prompt(ctx, segment):
+    """优化图像提示词，添加儿童绘本风格；没有提示词时该段配图失败"""
+    image_prompt = segment.get('image_prompt', '')
+    if not image_prompt:
+        return ""
+    return f"""{image_prompt}
 
 Style: Children's book illustration, warm and friendly, soft colors, cartoon style, digital art, high quality"""
-                    
-                    # 调用图像模型生成图片
-                    message.content = enhanced_prompt
-                    print(f'第{i}段图像提示词: \n{enhanced_prompt}')
-                    
-                    sent_files = []
-                    async for msg in fp.stream_request(
-                        request, IMAGE_MODEL, request.access_key
-                    ):
-                        # Add whatever logic you'd like to handle text responses from the Bot
-                        pass
-                        # If there is an attachment, add it to the list of sent files
-                        if msg.attachment:
-                            print(f'第{i}段图像响应:', msg.attachment)
-                            sent_files.append(msg.attachment)
-                    #print(f'第{i}段图像响应:', image_response)
-                    for file in sent_files:
-                        yield fp.PartialResponse(text=f"![第{i}段图像]({file.url})\n\n")
-                else:
-                    yield fp.PartialResponse(text="⚠️ Failed to create image...\n\n")
-            
-            # 第三步：完成提示
-            yield fp.PartialResponse(text="✨ **Done creating story for you！** Hope you and your kid(s) like the story！")
-            
-        except Exception as e:
-            print(f"发生错误: {e}")
-            yield fp.PartialResponse(text=f"Sorry, system error：{str(e)}")
-            return
-    
+
+
+def render_story(ctx):
+    """按段落顺序渲染完整消息，未完成的配图显示占位符"""
+    parts = ["🎨 **Creating a new story for you...** \n\n"]
+    for i, segment in enumerate(ctx.items, 1):
+        parts.append(f"**Section {i}：**\n{segment.get('story_text', '')}\n\n")
+        image_markdown = ctx.images[i - 1]
+        parts.append(image_markdown if image_markdown is not None else f"🖌️ *Drawing illustration {i}...*\n\n")
+    return "".join(parts)
+
+
+def extract_story_json(response_text):
+    """从 LLM 响应中提取故事 JSON 数据：先严格解析 JSON，再容错解析；
+    格式不对时抛出 ParseError，由调用方按实际作答的模型记录"""
+    result = parsing.parse_items(response_text, "story_text")
+    if result.value is None:
+        raise parsing.ParseError("no json found")
+
+    # 验证数据格式
+    story_data = result.value
+    if len(story_data) != 4:
+        raise parsing.ParseError("not a list of 4 segments")
+    for segment in story_data:
+        if 'image_prompt' not in segment:
+            raise parsing.ParseError("bad segment")
+    return story_data
+
+
+def error_text(e):
+    """出错时给用户的提示；超时异常没有错误信息"""
+    if isinstance(e, asyncio.TimeoutError):
+        return "Sorry, the story is taking too long to write. Please try again."
+    return f"Sorry, system error：{str(e) or type(e).__name__}"
+
+
+class ChildrenStoryCreatorBot(PipelineBot):
+    # 流式读取 LLM 输出，每段故事一完成就立即显示并开始生成配图，
+    # 配图完成后按段落顺序重新渲染完整消息
+    pipeline = Pipeline(
+        "children-story-creator",
+        extract=ExtractItems(
+            [LLM_MODEL, LLM_FALLBACK_MODEL],
+            story_prompt,
+            key="story_text",
+            # 流式解析没有得到任何段落时，回退到解析完整响应
+            fallback=extract_story_json,
+            # 完整响应也解析失败时，让快速模型整理格式后再解析一次
+            repair=Repair(REPAIR_MODEL, STORY_SHAPE, attempts=REPAIR_ATTEMPTS, budget=REPAIR_BUDGET),
+            empty_text="Sorry, failed to generate story.",
+            attempt_timeout=LLM_ATTEMPT_TIMEOUT,
+        ),
+        compose=compose_image_prompt,
+        render=Render(
+            [IMAGE_MODEL, IMAGE_FALLBACK_MODEL],
+            concurrency=IMAGE_CONCURRENCY,
+            hedge_after=IMAGE_HEDGE_AFTER,
+            alt="第{n}段图像",
+            failed_text="⚠️ Failed to create image...\n\n",
+        ),
+        emit=render_story,
+        progressive=True,
+        footer="✨ **Done creating story for you！** Hope you and your kid(s) like the story！",
+        error_text=error_text,
+    )
+
     async def get_settings(self, setting: fp.SettingsRequest) -> fp.SettingsResponse:
         return fp.SettingsResponse(
-            server_bot_dependencies={LLM_MODEL: 1, IMAGE_MODEL: 4}, 
+            server_bot_dependencies={LLM_MODEL: 1, LLM_FALLBACK_MODEL: 1, REPAIR_MODEL: REPAIR_ATTEMPTS,
+                                     IMAGE_MODEL: 4, IMAGE_FALLBACK_MODEL: 4},
             introduction_message="🎨 **Welcome to Children Story Pro！Provide me a topic or requirement! If you are non-Chinese user, specify your language in the prompt.**",
             allow_attachments=False
         )
-    
-    def extract_story_json(self, response_text):
-        """从 LLM 响应中提取故事 JSON 数据"""
-        try:
-            # 尝试找到 JSON 代码块
-            json_pattern = r'```json\s*([\s\S]*?)\s*```'
-            match = re.search(json_pattern, response_text)
-            
-            if match:
-                json_str = match.group(1).strip()
-            else:
-                # 如果没有代码块，尝试直接解析整个响应
-                # 寻找数组开始和结束
-                start_idx = response_text.find('[')
-                end_idx = response_text.rfind(']')
-                if start_idx != -1 and end_idx != -1:
-                    json_str = response_text[start_idx:end_idx+1]
-                else:
-                    print("无法找到有效的 JSON 数据")
-                    return None
-            
-            # 解析 JSON
-            story_data = json.loads(json_str)
-            
-            # 验证数据格式
-            if isinstance(story_data, list) and len(story_data) == 4:
-                for segment in story_data:
-                    if not isinstance(segment, dict) or 'story_text' not in segment or 'image_prompt' not in segment:
-                        print("JSON 数据格式不正确")
-                        return None
-                return story_data
-            else:
-                print("故事数据不是包含4个段落的数组")
-                return None
-                
-        except json.JSONDecodeError as e:
-            print(f"JSON 解析错误: {e}")
-            return None
-        except Exception as e:
-            print(f"提取故事数据时发生错误: {e}")
-            return None
-
-
-REQUIREMENTS = ["fastapi-poe==0.0.63"]
-image = Image.debian_slim().pip_install(*REQUIREMENTS)
+
+
+image = deploy.base_image()
 app = App("children-story-creator-poe")
 
 
-@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()])
+@app.function(image=image, secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()], **deploy.container_options())
 @asgi_app()
 def fastapi_app():
     bot = ChildrenStoryCreatorBot()
@@ -197,4 +189,5 @@ def fastapi_app():
     
     # 使用环境变量中的访问密钥
     app = fp.make_app(bot, access_key=os.environ.get("CHILDREN_STORY_BOT_KEY", ""))
+    metrics.install(app)
     return app
\ No newline at end of file
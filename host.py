@@ -0,0 +1,145 @@
+"""
+
+Host all deploy1/deploy2 bots in one Modal app.
+
+Every bot is served by the same ASGI app under its own path with its own access
+key, e.g. Pic2Pixar answers at https://<host>/pixar-plus. Point each bot's
+server URL on poe.com at its path. Bots whose key is not set are skipped.
+
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+
+import fastapi_poe as fp
+import modal
+from modal import App, asgi_app
+
+from botkit import deploy, metrics, warmpool
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (path, bot file, bot class, access key env var)
+BOTS = [
+    ("/anime-plus", "deploy1/anime_plus.py", "CartoonAvatarBot", "ANIME_PLUS_BOT_KEY"),
+    (
+        "/anime-plus-vg",
+        "deploy1/anime_plus_van_gogh.py",
+        "CartoonAvatarBot",
+        "ANIME_VAN_GOGH_BOT_KEY",
+    ),
+    ("/anime-pro", "deploy1/anime_pro.py", "CartoonAvatarBot", "ANIME_PRO_BOT_KEY"),
+    (
+        "/anime-yourself",
+        "deploy1/anime_self.py",
+        "CartoonAvatarBot",
+        "ANIME_SELF_BOT_KEY",
+    ),
+    (
+        "/cartoon-avatar",
+        "deploy1/cartoon_avatar.py",
+        "CartoonAvatarBot",
+        "AVATAR_BOT_KEY",
+    ),
+    ("/memes-creator", "deploy1/memes_creator.py", "MemesCreatorBot", "MEME_BOT_KEY"),
+    (
+        "/ogimage-pro",
+        "deploy1/ogimage_creator_pro.py",
+        "OgImageCreatorBot",
+        "OG_IMAGE_PRO_BOT_KEY",
+    ),
+    ("/pixar-plus", "deploy1/pic2pixar_plus.py", "Pic2PixarBot", "PIXAR_PLUS_BOT_KEY"),
+    (
+        "/fourpanelcomics-pro",
+        "deploy2/4panelcomics_pro.py",
+        "OgImageCreatorBot",
+        "FOURPANEL_BOT_KEY",
+    ),
+    (
+        "/children-story-creator",
+        "deploy2/children_story_creator.py",
+        "ChildrenStoryCreatorBot",
+        "CHILDREN_STORY_BOT_KEY",
+    ),
+    (
+        "/web-designer-pro",
+        "deploy2/landing_design.py",
+        "OgImageCreatorBot",
+        "WEBDESIGNER_BOT_KEY",
+    ),
+    (
+        "/og-designer-pro",
+        "deploy2/og_design.py",
+        "OgImageCreatorBot",
+        "OGDESIGNER_BOT_KEY",
+    ),
+    ("/ghibli", "deploy2/pic2ghibli.py", "Pic2GhibliBot", "PIC2GHIBLI_BOT_KEY"),
+    (
+        "/poster-designer-pro",
+        "deploy2/poster_design.py",
+        "OgImageCreatorBot",
+        "POSTERDESIGNER_BOT_KEY",
+    ),
+]
+
+# requests handled at once by one container, shared by all bots
+MAX_CONCURRENT_INPUTS = 100
+
+
+def load_bot_class(bot_file, class_name):
+    # bot files are loaded by path: several share class names and 4panelcomics_pro
+    # is not a valid module name
+    module_name = os.path.splitext(os.path.basename(bot_file))[0]
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(ROOT, bot_file)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, class_name)
+
+
+def build_bots():
+    bots = []
+    for path, bot_file, class_name, key_env in BOTS:
+        access_key = os.environ.get(key_env)
+        if not access_key:
+            print(f"Skip {path}: {key_env} is not set")
+            continue
+        bot_class = load_bot_class(bot_file, class_name)
+        bots.append(bot_class(path=path, access_key=access_key))
+    return bots
+
+
+image = (
+    deploy.base_image()
+    .add_local_dir(os.path.join(ROOT, "deploy1"), "/root/deploy1")
+    .add_local_dir(os.path.join(ROOT, "deploy2"), "/root/deploy2")
+)
+app = App("poe-bots-host")
+
+
+@app.function(
+    image=image,
+    secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()],
+    **deploy.container_options(),
+)
+@modal.concurrent(max_inputs=MAX_CONCURRENT_INPUTS)
+@asgi_app()
+def fastapi_app():
+    app = fp.make_app(build_bots())
+    # one registry for all bots, labelled by bot
+    metrics.install(app)
+    warmpool.install(app)
+    return app
+
+
+# keep containers warm on the WARM_SCHEDULE, see botkit.warmpool
+@app.function(
+    image=image,
+    secrets=[modal.Secret.from_name("poe-secret"), modal.Secret.from_dotenv()],
+    schedule=modal.Period(minutes=warmpool.WARM_PING_MINUTES),
+)
+def keep_warm():
+    warmpool.tick(fastapi_app)
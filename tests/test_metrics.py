@@ -0,0 +1,30 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from botkit import metrics
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    metrics.install(app)
+    return TestClient(app)
+
+
+def test_off_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+    assert client.get("/metrics").status_code == 404
+    headers = {"Authorization": "Bearer "}
+    assert client.get("/metrics", headers=headers).status_code == 404
+
+
+def test_requires_the_bearer_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    assert client.get("/metrics").status_code == 401
+    wrong = {"Authorization": "Bearer nope"}
+    assert client.get("/metrics", headers=wrong).status_code == 401
+    right = {"Authorization": "Bearer s3cret"}
+    response = client.get("/metrics", headers=right)
+    assert response.status_code == 200
+    assert "botkit_request_seconds" in response.text
@@ -0,0 +1,92 @@
+import pytest
+
+from botkit.parsing import ParseError, parse_fields, parse_items, require_fields
+
+WANTED = ("image_prompt", "caption")
+
+
+def test_escaped_quote_inside_value():
+    text = '{"image_prompt": "a cat", "caption": "she said \\"hi\\" twice"}'
+    result = parse_fields(text, WANTED)
+    assert result.ok
+    assert result.method == "json"
+    assert result.value == {"image_prompt": "a cat", "caption": 'she said "hi" twice'}
+
+
+def test_escaped_quote_in_bare_pairs():
+    # the prompt templates have no braces, and neither do many replies
+    text = '"image_prompt": "a \\"happy\\" cat",\n"caption": "hi"'
+    result = parse_fields(text, WANTED)
+    assert result.ok
+    assert result.value["image_prompt"] == 'a "happy" cat'
+
+
+def test_escaped_quote_in_broken_json_is_recovered():
+    # a trailing comma breaks json.loads, the tolerant scan still reads it
+    text = '{"image_prompt": "a \\"happy\\" cat", "caption": "hi",,}'
+    result = parse_fields(text, WANTED)
+    assert result.ok
+    assert result.method == "recovered"
+    assert result.value["image_prompt"] == 'a "happy" cat'
+
+
+def test_fenced_block_with_prose_around():
+    text = (
+        "Sure! Here it is:\n```json\n"
+        '{"image_prompt": "a cat on a roof", "caption": "Monday mood"}\n'
+        "```\nEnjoy!"
+    )
+    result = parse_fields(text, WANTED)
+    assert result.ok
+    assert result.method == "json"
+    assert result.value == {"image_prompt": "a cat on a roof", "caption": "Monday mood"}
+
+
+def test_fenced_list_of_items():
+    text = (
+        "```json\n"
+        '[{"story_text": "one", "image_prompt": "p1"},\n'
+        ' {"story_text": "two", "image_prompt": "p2"}]\n'
+        "```"
+    )
+    result = parse_items(text, "story_text")
+    assert result.method == "json"
+    assert [item["story_text"] for item in result.value] == ["one", "two"]
+
+
+def test_reply_cut_off_mid_string():
+    text = '```json\n{"image_prompt": "a cat", "caption": "Monday mo'
+    result = parse_fields(text, WANTED)
+    assert not result.ok
+    assert result.method == "recovered"
+    assert result.value == {"image_prompt": "a cat"}
+    assert result.missing == ("caption",)
+
+
+def test_require_fields_rejects_a_cut_off_reply():
+    text = '```json\n{"image_prompt": "a cat", "caption": "Monday mo'
+    with pytest.raises(ParseError) as error:
+        require_fields({}, text, WANTED, "some-model")
+    assert error.value.missing == ("caption",)
+
+
+def test_require_fields_completes_streamed_fields():
+    text = '{"image_prompt": "a cat", "caption": "hi"}'
+    fields = require_fields({"image_prompt": "a cat"}, text, WANTED, "some-model")
+    assert fields == {"image_prompt": "a cat", "caption": "hi"}
+
+
+def test_items_of_a_reply_cut_off_mid_string():
+    text = (
+        '[{"story_text": "one", "image_prompt": "p1"}, '
+        '{"story_text": "two", "image_prompt": "p'
+    )
+    result = parse_items(text, "story_text")
+    assert result.method == "recovered"
+    assert result.value == [{"story_text": "one", "image_prompt": "p1"}]
+
+
+def test_no_json_at_all():
+    result = parse_items("I could not write that story.", "story_text")
+    assert result.value is None
+    assert result.missing == ("story_text",)
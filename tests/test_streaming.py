@@ -0,0 +1,82 @@
+import pytest
+
+from botkit.streaming import FieldExtractor
+
+REPLY = (
+    "```json\n"
+    '"caption": "she said \\"hi\\"\\nthen left \\u00e9t\\u00e9",\n'
+    '"image_prompt": "a cat \\\\ a dog"\n'
+    "```"
+)
+EXPECTED = {"caption": 'she said "hi"\nthen left été', "image_prompt": "a cat \\ a dog"}
+
+
+def feed_chunks(text, size):
+    extractor = FieldExtractor(("caption", "image_prompt"))
+    for start in range(0, len(text), size):
+        extractor.feed(text[start : start + size])
+    return extractor
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 10_000])
+def test_any_chunking_gives_the_same_fields(size):
+    extractor = feed_chunks(REPLY, size)
+    assert extractor.fields == EXPECTED
+    assert extractor.complete
+
+
+@pytest.mark.parametrize("split", range(1, len(REPLY)))
+def test_every_split_point(split):
+    # covers splits right after a backslash and inside \uXXXX escapes
+    extractor = FieldExtractor(("caption", "image_prompt"))
+    extractor.feed(REPLY[:split])
+    extractor.feed(REPLY[split:])
+    assert extractor.fields == EXPECTED
+
+
+def test_split_after_backslash_does_not_close_the_string():
+    seen = []
+    extractor = FieldExtractor(on_field=lambda key, value: seen.append((key, value)))
+    extractor.feed('"caption": "say \\')
+    extractor.feed('"')
+    assert seen == []
+    extractor.feed('hi\\"",')
+    assert seen == [("caption", 'say "hi"')]
+
+
+def test_field_is_reported_when_its_value_closes():
+    seen = []
+    extractor = FieldExtractor(on_field=lambda key, value: seen.append(key))
+    extractor.feed('{"image_prompt": "a c')
+    assert seen == []
+    extractor.feed('at", "cap')
+    assert seen == ["image_prompt"]
+    extractor.feed('tion": "hi"}')
+    assert seen == ["image_prompt", "caption"]
+
+
+def test_objects_across_chunks():
+    objects = []
+    extractor = FieldExtractor(on_object=objects.append)
+    text = '[{"story_text": "one", "image_prompt": "p1"}, {"story_text": "tw'
+    for ch in text:
+        extractor.feed(ch)
+    assert objects == [{"story_text": "one", "image_prompt": "p1"}]
+    extractor.feed('o", "image_prompt": "p2"}]')
+    assert objects[1] == {"story_text": "two", "image_prompt": "p2"}
+
+
+def test_key_split_from_its_colon():
+    extractor = FieldExtractor(("caption",))
+    extractor.feed('"caption"')
+    extractor.feed(" ")
+    extractor.feed(': "hi"')
+    assert extractor.fields == {"caption": "hi"}
+
+
+def test_reset_forgets_partial_state():
+    extractor = FieldExtractor(("caption",))
+    extractor.feed('"caption": "half \\')
+    extractor.reset()
+    extractor.feed('"caption": "whole"')
+    assert extractor.fields == {"caption": "whole"}